@@ -1,27 +1,59 @@
 import os
-import jsonpickle
-from google.genai import types
+import json
+from typing import Any, Dict
+
+# Compacted history: {"generation": g, "count": n, "messages": [...]}
+HISTORY_SNAPSHOT_FILE = "content_history.snapshot.json"
+# Append-only journal of messages added since the snapshot, one [generation, index, message] per line
+HISTORY_JOURNAL_FILE = "content_history.jsonl"
+# Pre-journal history written with jsonpickle; only read, to migrate old sessions
+LEGACY_HISTORY_FILE = "content_history.json"
+# Journal entries accumulated before the history is compacted into a new snapshot
+HISTORY_SNAPSHOT_INTERVAL = 200
+
+def to_jsonable(obj):
+    """json.dumps fallback for SDK objects (OpenAI messages, MCP content) in the history."""
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json", exclude_none=True)
+    if hasattr(obj, "__dict__"):
+        return {k: v for k, v in vars(obj).items() if v is not None}
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def _dumps(obj) -> str:
+    return json.dumps(obj, default=to_jsonable, separators=(",", ":"), ensure_ascii=False)
 
 class Agent:
-    def __init__(self):
+    def __init__(self, history_dir: str = ""):
+        """history_dir holds the snapshot and journal files (default: the working directory)."""
+        if history_dir:
+            os.makedirs(history_dir, exist_ok=True)
+        self.snapshot_file = os.path.join(history_dir, HISTORY_SNAPSHOT_FILE)
+        self.journal_file = os.path.join(history_dir, HISTORY_JOURNAL_FILE)
+        self.legacy_file = os.path.join(history_dir, LEGACY_HISTORY_FILE)
 
         self.system_instruction=""
         self._initialize_system_instruction()
 
-        if os.path.exists("content_history.json"):
-            try:
-                with open("content_history.json", "r") as f: # Changed to 'r' as decode doesn't need 'r+'
-                    content = f.read()
-                    if content: # Check if file is not empty
-                        self.content_history = jsonpickle.decode(content)
-                    else:
-                        self._initialize_history() # Initialize if empty
-            except Exception as e: # Catch potential errors during read/decode
-                 print(f"Warning: Error reading or decoding content_history.json: {e}. Initializing fresh history.")
-                 self._initialize_history()
-        else:
+        # Number of messages already persisted in the snapshot + journal
+        self._persisted = 0
+        self._journal_entries = 0
+        # Bumped on every compaction so stale journal entries are never replayed
+        self._generation = 0
+
+        try:
+            if os.path.exists(self.snapshot_file) or os.path.exists(self.journal_file):
+                self._load_history()
+            elif os.path.exists(self.legacy_file):
+                self._load_legacy_history()
+            else:
+                self._initialize_history()
+        except Exception as e: # Catch potential errors during read/decode
+            print(f"Warning: Error reading or decoding content history: {e}. Initializing fresh history.")
             self._initialize_history()
-    
+            self._persisted = 0
+            self._journal_entries = 0
+            self._generation = 0
+
     def _initialize_system_instruction(self):
         """Initializes the system instruction with the default prompt."""
         self.system_instruction = """You are a pro-active AI assistant that is confident and proceeds to carry out next action required to complete the user's request.
@@ -32,11 +64,86 @@ Always use the tool 'ask' to ask the user for clarification if user input is req
         """Initializes the content history with the default prompt."""
         self.content_history = []
 
-    def add_content(self, content: types.Content):
+    def _load_history(self):
+        """Load the latest snapshot and replay the journal entries written after it."""
+        self.content_history = []
+        if os.path.exists(self.snapshot_file):
+            with open(self.snapshot_file, "r") as f:
+                snapshot = json.load(f)
+            self._generation = snapshot["generation"]
+            self.content_history = snapshot["messages"][:snapshot["count"]]
+
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "r") as f:
+                for line in f:
+                    try:
+                        generation, index, message = json.loads(line)
+                    except ValueError:
+                        # A torn final line from an interrupted append
+                        break
+                    # Entries from an older generation or below the snapshot count were already compacted
+                    if generation == self._generation and index == len(self.content_history):
+                        self.content_history.append(message)
+                        self._journal_entries += 1
+
+        self._persisted = len(self.content_history)
+
+    def _load_legacy_history(self):
+        """Load a jsonpickle history file and convert it to the journal format."""
+        import jsonpickle
+
+        with open(self.legacy_file, "r") as f:
+            content = f.read()
+        self.content_history = jsonpickle.decode(content) if content else []
+        self.compact_history()
+
+    def add_content(self, content: Dict[str, Any]):
         """Add a content object to the content history."""
         self.content_history.append(content)
-    
+
     def save_history(self):
-        """Save the content history to a file."""
-        with open("content_history.json", "w") as f:
-            f.write(jsonpickle.encode(self.content_history, indent=2))
\ No newline at end of file
+        """Append messages added since the last save to the history journal.
+
+        Falls back to a full compaction when the history was rewritten rather
+        than appended to, or when the journal has grown past the snapshot interval.
+        """
+        if len(self.content_history) < self._persisted:
+            self.compact_history()
+            return
+
+        new_messages = self.content_history[self._persisted:]
+        if not new_messages:
+            return
+
+        lines = "".join(
+            _dumps([self._generation, index, message]) + "\n"
+            for index, message in enumerate(new_messages, start=self._persisted)
+        )
+        with open(self.journal_file, "a") as f:
+            f.write(lines)
+        self._persisted = len(self.content_history)
+        self._journal_entries += len(new_messages)
+
+        if self._journal_entries >= HISTORY_SNAPSHOT_INTERVAL:
+            self.compact_history()
+
+    def compact_history(self):
+        """Write the whole history as a new snapshot and reset the journal.
+
+        Call this after modifying or removing existing messages; appends only
+        need save_history.
+        """
+        generation = self._generation + 1
+        snapshot = {"generation": generation, "count": len(self.content_history), "messages": self.content_history}
+        temp_path = self.snapshot_file + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write(_dumps(snapshot))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.snapshot_file)
+        # The journal is only cleared once the snapshot covering it is in place
+        with open(self.journal_file, "w"):
+            pass
+        self._generation = generation
+        self._persisted = len(self.content_history)
+        self._journal_entries = 0
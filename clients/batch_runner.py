@@ -0,0 +1,147 @@
+#!/usr/bin/env -S PYTHONPATH=. uv run --script
+# /// script
+# dependencies = [ "mcp[cli]>=1.10.0,<2", "openai", "httpx", "anyio", "prompt_toolkit", "jsonpickle"]
+# ///
+
+"""Run many agent sessions headlessly, concurrently on one event loop.
+
+Tasks are read from a JSONL file, one {"id": ..., "prompt": ..., "max_turns": ...}
+object per line ("id" and "max_turns" are optional). Every session has its own
+history under --sessions-dir/<id> but all of them share the MCP connections and
+the LLM client. One result line per task, with timing and token counts, is
+appended to --output as soon as the task finishes.
+
+    ./batch_runner.py tasks.jsonl --output results.jsonl --concurrency 32 --max-llm-requests 8
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import time
+from typing import Any, Dict, List, Set
+
+from agent import Agent
+from mcp_servers import MCPServerPool, find_server_config, load_server_config
+from openai_client import MCPClient, create_provider, setup_logging
+
+def load_tasks(path: str) -> List[Dict[str, Any]]:
+    tasks = []
+    with open(path, "r") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            task = json.loads(line)
+            if not task.get("prompt"):
+                raise ValueError(f"{path}:{line_number}: task has no 'prompt'")
+            task["id"] = str(task.get("id", line_number))
+            tasks.append(task)
+    return tasks
+
+def completed_ids(path: str) -> Set[str]:
+    """Ids of tasks that already have a result (other than an error) in the output file."""
+    if not os.path.exists(path):
+        return set()
+    ids = set()
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("status") != "error":
+                ids.add(record["id"])
+    return ids
+
+def session_dir(root: str, task_id: str) -> str:
+    return os.path.join(root, re.sub(r"[^\w.-]", "_", task_id))
+
+async def run_batch(args, servers: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+    tasks = load_tasks(args.tasks)
+    if args.resume:
+        done = completed_ids(args.output)
+        tasks = [task for task in tasks if task["id"] not in done]
+    logging.info(f"Running {len(tasks)} tasks, {args.concurrency} at a time")
+
+    pool = MCPServerPool(servers)
+    if not await pool.connect():
+        raise ConnectionError("Could not connect to any MCP server")
+    provider = create_provider()
+    llm_semaphore = asyncio.Semaphore(max(args.max_llm_requests, 1))
+    session_semaphore = asyncio.Semaphore(max(args.concurrency, 1))
+    statuses: Dict[str, int] = {}
+
+    async def run_one(task: Dict[str, Any], output):
+        async with session_semaphore:
+            history_dir = session_dir(args.sessions_dir, task["id"])
+            # A rerun starts the session afresh rather than continuing its old history
+            shutil.rmtree(history_dir, ignore_errors=True)
+            client = MCPClient(
+                pool,
+                max_parallel_tool_calls=args.max_parallel_tools,
+                provider=provider,
+                agent=Agent(history_dir=history_dir),
+                llm_semaphore=llm_semaphore,
+                interactive=False,
+            )
+            start = time.perf_counter()
+            try:
+                outcome = await client.run_task(task["prompt"], max_turns=task.get("max_turns", args.max_turns))
+            except Exception as e:
+                outcome = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+            record = {
+                "id": task["id"],
+                **outcome,
+                "elapsed_s": round(time.perf_counter() - start, 3),
+                **client.stats,
+                "history_dir": history_dir,
+            }
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+            logging.info(f"Task {task['id']}: {record['status']} in {record['elapsed_s']:.1f}s ({sum(statuses.values())}/{len(tasks)})")
+
+    try:
+        with open(args.output, "a") as output:
+            await asyncio.gather(*(run_one(task, output) for task in tasks))
+    finally:
+        await pool.close()
+    return statuses
+
+def main():
+    parser = argparse.ArgumentParser(description="Run agent sessions from a JSONL task file without a user")
+    parser.add_argument("tasks", help='JSONL file of {"id", "prompt", "max_turns"} tasks')
+    parser.add_argument("--output", default="batch_results.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("--sessions-dir", default="batch_sessions", help="Directory holding one history directory per task")
+    parser.add_argument("--server-url", help="URL of a single MCP server; defaults to the servers in --config")
+    parser.add_argument("--config", help="mcp.json file listing the servers to connect to (default: .cursor/mcp.json or mcp.json, searched upwards)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Sessions to run at once")
+    parser.add_argument("--max-llm-requests", type=int, default=8, help="LLM requests in flight at once, across all sessions")
+    parser.add_argument("--max-turns", type=int, default=50, help="Model turns per task unless the task sets max_turns")
+    parser.add_argument("--max-parallel-tools", type=int, default=4, help="Maximum read-only tool calls to run concurrently per session")
+    parser.add_argument("--resume", action="store_true", help="Skip tasks that already have a result in --output")
+    parser.add_argument("--debug", action="store_true", help="Enable debug logging")
+    args = parser.parse_args()
+
+    setup_logging(debug=args.debug)
+
+    if args.server_url:
+        servers = {"default": {"url": args.server_url}}
+    else:
+        config_path = args.config or find_server_config()
+        if not config_path:
+            parser.error("Pass --server-url or --config, or add a .cursor/mcp.json")
+        servers = load_server_config(config_path)
+        if not servers:
+            parser.error(f"No URL-based MCP servers in {config_path}")
+
+    statuses = asyncio.run(run_batch(args, servers))
+    logging.info(f"Finished: {', '.join(f'{count} {status}' for status, count in sorted(statuses.items())) or 'no tasks'}")
+    sys.exit(1 if statuses.get("error") else 0)
+
+if __name__ == "__main__":
+    main()
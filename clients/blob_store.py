@@ -0,0 +1,111 @@
+import os
+import hashlib
+import tempfile
+from typing import Optional
+
+# Tool results longer than this many characters are stored as blobs and referenced from the history
+TOOL_RESULT_INLINE_CHARS = int(os.getenv("TOOL_RESULT_INLINE_CHARS", "16000"))
+TOOL_RESULT_BLOB_DIR = os.getenv("TOOL_RESULT_BLOB_DIR", "tool_result_blobs")
+# Characters of the head and tail kept in the history next to the digest
+PREVIEW_CHARS = 1500
+READ_LINES_DEFAULT = 400
+
+READ_TOOL_RESULT = "read_tool_result"
+# Start of the summary that replaces a spilled result in the history
+STORED_RESULT_PREFIX = "[Tool result stored as sha256:"
+# Client-side tool for reading spilled results back, in OpenAI function format
+READ_TOOL_RESULT_SCHEMA = {
+    "type": "function",
+    "function": {
+        "name": READ_TOOL_RESULT,
+        "description": "Read lines of an earlier tool result that was too large to keep in the conversation, by its sha256 digest.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "digest": {"type": "string", "description": "The sha256 digest shown in the stored result"},
+                "offset": {"type": "integer", "description": "0-based line to start from", "default": 0},
+                "limit": {"type": "integer", "description": "Number of lines to read", "default": READ_LINES_DEFAULT},
+            },
+            "required": ["digest"],
+        },
+    },
+}
+
+def _normalize(digest: str) -> str:
+    return digest.strip().removeprefix("sha256:").lower()
+
+class BlobStore:
+    """Content-addressed store of large tool results, one file per sha256 digest.
+
+    Identical results are stored once. Blobs are written to a temp file and
+    renamed into place, so a reader never sees a partial blob.
+    """
+
+    def __init__(self, root: str = TOOL_RESULT_BLOB_DIR, inline_chars: int = TOOL_RESULT_INLINE_CHARS):
+        self.root = root
+        self.inline_chars = inline_chars
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if os.path.exists(path):
+            return digest
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        return digest
+
+    def get(self, digest: str) -> Optional[bytes]:
+        digest = _normalize(digest)
+        if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+            return None
+        try:
+            with open(self._path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def spill(self, text: str) -> str:
+        """Return text unchanged if it is short, else store it and return a digest-referenced summary."""
+        if len(text) <= self.inline_chars:
+            return text
+        data = text.encode("utf-8")
+        digest = self.put(data)
+        lines = text.count("\n") + 1
+        return (
+            f"{STORED_RESULT_PREFIX}{digest} ({len(data):,} bytes, {lines:,} lines). "
+            f"Showing the first and last {PREVIEW_CHARS} characters; call {READ_TOOL_RESULT} with this digest "
+            f"and a line offset/limit to read the rest.]\n"
+            f"{text[:PREVIEW_CHARS]}\n"
+            f"[... {len(text) - 2 * PREVIEW_CHARS:,} characters omitted ...]\n"
+            f"{text[-PREVIEW_CHARS:]}"
+        )
+
+    def read_lines(self, digest: str, offset: int = 0, limit: int = READ_LINES_DEFAULT) -> str:
+        """Lines [offset, offset + limit) of a stored result, capped so the answer is never spilled again."""
+        digest = _normalize(digest)
+        data = self.get(digest)
+        if data is None:
+            return f"No stored tool result with digest {digest}"
+        lines = data.decode("utf-8", errors="replace").split("\n")
+        offset = max(offset, 0)
+        selected = lines[offset:offset + max(limit, 1)]
+        text = "\n".join(selected)
+        if len(text) > self.inline_chars:
+            text = text[:self.inline_chars]
+            selected = text.split("\n")[:-1] or [text]
+            text = "\n".join(selected)
+        end = offset + len(selected)
+        header = f"[Lines {offset}-{end} of {len(lines)} from sha256:{digest}"
+        header += f"; continue with offset={end}]" if end < len(lines) else "]"
+        return f"{header}\n{text}"
@@ -0,0 +1,125 @@
+import os
+import json
+import hashlib
+import tempfile
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from agent import to_jsonable
+
+# record: always call the provider and store the answer; replay: answer from the cache, calling the
+# provider (and recording) on a miss; replay-or-fail: answer from the cache only
+LLM_CACHE_MODES = ("record", "replay", "replay-or-fail")
+DEFAULT_LLM_CACHE_DIR = "llm_cache"
+
+# Request fields that decide the answer; anything else (stream_options, timeouts) is ignored
+KEY_FIELDS = ("model", "messages", "tools", "temperature", "stream")
+
+class CompletionCacheMiss(LookupError):
+    pass
+
+def _drop_none(value):
+    """Remove None fields so SDK objects and their JSON wire form hash the same."""
+    if isinstance(value, dict):
+        return {k: _drop_none(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_drop_none(v) for v in value]
+    return value
+
+def completion_key(request: Dict[str, Any]) -> str:
+    """Stable sha256 of the fields of a chat completion request that decide its answer."""
+    fields = {name: request.get(name) for name in KEY_FIELDS}
+    fields["stream"] = bool(fields["stream"])
+    # Round trip through JSON first so messages holding SDK objects become plain dicts
+    plain = json.loads(json.dumps(fields, default=to_jsonable))
+    canonical = json.dumps(_drop_none(plain), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class CompletionCache:
+    """Recorded chat completions on disk, one JSON file per request key.
+
+    Streamed answers are stored as their list of chunks and played back chunk
+    by chunk, so the client sees the same deltas it saw when recording.
+    """
+
+    def __init__(self, root: str = DEFAULT_LLM_CACHE_DIR):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def load(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(key), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def store(self, key: str, request: Dict[str, Any], response: Optional[Dict[str, Any]] = None, chunks: Optional[List[Dict[str, Any]]] = None):
+        entry = {"key": key, "model": request.get("model"), "stream": bool(request.get("stream"))}
+        if chunks is not None:
+            entry["chunks"] = chunks
+        else:
+            entry["response"] = response
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+async def _replay_chunks(chunks: List[Dict[str, Any]]) -> AsyncIterator["ChatCompletionChunk"]:
+    from openai.types.chat import ChatCompletionChunk
+
+    for chunk in chunks:
+        yield ChatCompletionChunk.model_validate(chunk)
+
+class CachingProvider:
+    """Drop-in for AsyncOpenAI's chat.completions.create that records and replays answers.
+
+    upstream may be None in replay-or-fail mode, so cached runs need no API key
+    or network at all.
+    """
+
+    def __init__(self, upstream, mode: str, cache: Optional[CompletionCache] = None):
+        if mode not in LLM_CACHE_MODES:
+            raise ValueError(f"Unknown LLM cache mode '{mode}', expected one of {', '.join(LLM_CACHE_MODES)}")
+        self.upstream = upstream
+        self.mode = mode
+        self.cache = cache or CompletionCache()
+        self.hits = 0
+        self.misses = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **request):
+        key = completion_key(request)
+        if self.mode != "record":
+            entry = self.cache.load(key)
+            if entry is not None:
+                self.hits += 1
+                if "chunks" in entry:
+                    return _replay_chunks(entry["chunks"])
+                from openai.types.chat import ChatCompletion
+                return ChatCompletion.model_validate(entry["response"])
+            self.misses += 1
+            if self.mode == "replay-or-fail" or self.upstream is None:
+                raise CompletionCacheMiss(f"No recorded completion for request {key} (model {request.get('model')})")
+
+        response = await self.upstream.chat.completions.create(**request)
+        if request.get("stream"):
+            return self._record_stream(key, request, response)
+        self.cache.store(key, request, response=response.model_dump(mode="json", exclude_none=True))
+        return response
+
+    async def _record_stream(self, key: str, request: Dict[str, Any], stream) -> AsyncIterator["ChatCompletionChunk"]:
+        """Pass chunks through as they arrive; the recording is written once the stream is complete."""
+        chunks = []
+        async for chunk in stream:
+            chunks.append(chunk.model_dump(mode="json", exclude_none=True))
+            yield chunk
+        self.cache.store(key, request, chunks=chunks)
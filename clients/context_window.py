@@ -0,0 +1,363 @@
+import os
+import re
+import json
+import math
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from agent import to_jsonable
+from blob_store import STORED_RESULT_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# Context window sizes by model name prefix (provider prefixes such as "google/" are ignored)
+MODEL_CONTEXT_LIMITS = [
+    ("gemini-", 1_048_576),
+    ("gpt-4.1", 1_047_576),
+    ("gpt-4o", 128_000),
+    ("o3", 200_000),
+    ("o4", 200_000),
+    ("claude-", 200_000),
+]
+DEFAULT_CONTEXT_LIMIT = 128_000
+# How providers word a rejected, too-long prompt, for those that send no context_length_exceeded code
+CONTEXT_OVERFLOW_PHRASES = (
+    "context_length_exceeded", "context length", "context window", "maximum context",
+    "prompt is too long", "too many tokens", "input token count",
+)
+
+# Rough estimate used until the provider reports real prompt token counts
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+READ_TOOL = "read_file"
+READ_MANY_TOOL = "read_many_files"
+EDIT_TOOLS = {"diff_fenced_edit_file"}
+EDITED_FILE_PATTERN = re.compile(r'```diff\n(.*?)\n<<<<<<< SEARCH\n')
+# Results of failed calls, which read nothing
+TOOL_ERROR_PREFIXES = ("Error executing tool ", "Tool call failed: ", "No connected MCP server offers tool ")
+STALE_READ_PREFIX = "[Stale read"
+
+# Part of a file a read returned: (unit, start, end), with unit None for the whole file
+Span = Tuple[Optional[str], int, float]
+WHOLE_FILE: Span = (None, 0, math.inf)
+# Some part of the file (a preview, or a range cut short), which only a whole-file read covers
+SOME_OF_FILE: Span = ("unknown", 0, 0)
+
+def _covers(outer: Span, inner: Span) -> bool:
+    if outer == SOME_OF_FILE:
+        return False
+    if outer[0] is None:
+        return True
+    return outer[0] == inner[0] and outer[1] <= inner[1] and inner[2] <= outer[2]
+
+def _json_object(text: str) -> Optional[Dict[str, Any]]:
+    if not text.startswith("{"):
+        return None
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
+def _read_file_span(arguments: Dict[str, Any], text: str) -> Span:
+    """The part of a file a successful read_file result holds: all of it, the range it returned, or a preview.
+
+    Results that were spilled to the blob store, or that are not in the form the
+    arguments call for, count as some unknown part of the file.
+    """
+    if text.startswith(STORED_RESULT_PREFIX):
+        return SOME_OF_FILE
+    result = _json_object(text)
+    if result is None or "offset" not in result and "truncated" not in result:
+        ranged = arguments.get("offset") is not None or arguments.get("limit") is not None
+        return SOME_OF_FILE if ranged else WHOLE_FILE
+    if "offset" not in result:
+        return SOME_OF_FILE
+    # A range cut short at the size limit ends at next_offset, like one asked for that way
+    end = math.inf if result.get("eof") or result.get("next_offset") is None else result["next_offset"]
+    return (result.get("unit", "lines"), result["offset"], end)
+
+def _read_many_spans(result: Dict[str, Any]) -> List[Tuple[int, str, Span]]:
+    """(entry index, path, span) of each file a read_many_files result holds, skipping failed and stale entries."""
+    spans = []
+    for position, entry in enumerate(result.get("files") or []):
+        if entry.get("status") not in ("ok", "truncated") or str(entry.get("content", "")).startswith(STALE_READ_PREFIX):
+            continue
+        if entry["status"] == "truncated":
+            span = SOME_OF_FILE
+        elif entry.get("range"):
+            # 1-based inclusive lines, as 0-based offsets with an exclusive end
+            span = ("lines", entry["range"][0] - 1, entry["range"][1])
+        else:
+            span = WHOLE_FILE
+        spans.append((position, entry["path"], span))
+    return spans
+
+def context_limit_for(model: Optional[str]) -> int:
+    """Context window for a model, overridable with MAIN_MODEL_CONTEXT_LIMIT."""
+    if os.getenv("MAIN_MODEL_CONTEXT_LIMIT"):
+        return int(os.getenv("MAIN_MODEL_CONTEXT_LIMIT"))
+    name = (model or "").rsplit("/", 1)[-1]
+    for prefix, limit in MODEL_CONTEXT_LIMITS:
+        if name.startswith(prefix):
+            return limit
+    return DEFAULT_CONTEXT_LIMIT
+
+def is_context_overflow(error: Exception) -> bool:
+    """Whether a rejected request failed because the prompt did not fit the model's context window."""
+    if getattr(error, "code", None) == "context_length_exceeded":
+        return True
+    message = str(error).lower()
+    return any(phrase in message for phrase in CONTEXT_OVERFLOW_PHRASES)
+
+def _field(message, name: str, default=None):
+    if isinstance(message, dict):
+        return message.get(name, default)
+    return getattr(message, name, default)
+
+def message_text(message) -> str:
+    """Flatten a message's content (string or list of content parts) to text."""
+    content = _field(message, "content")
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    return "\n".join(str(_field(part, "text", "")) for part in content)
+
+def estimate_tokens(message) -> int:
+    serialized = json.dumps(message, default=to_jsonable, separators=(",", ":"), ensure_ascii=False)
+    return len(serialized) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+def truncate_middle(text: str, max_chars: int) -> str:
+    if len(text) <= max_chars:
+        return text
+    omitted = len(text) - max_chars
+    return f"{text[:max_chars // 2]}\n[... {omitted} characters omitted ...]\n{text[-max_chars // 2:]}"
+
+class ContextWindow:
+    """Running token estimate of an Agent's history that compacts it before it overflows.
+
+    Per-message estimates are cached, so appending a message only costs the
+    estimate of that message. Reported prompt token counts rescale the
+    estimate so it tracks the provider's tokenizer.
+    """
+
+    def __init__(
+        self,
+        agent,
+        model: Optional[str],
+        reserve_tokens: int = 8192,
+        target_ratio: float = 0.7,
+        keep_recent_messages: int = 12,
+        max_old_tool_result_chars: int = 2000,
+    ):
+        self.agent = agent
+        self.limit = context_limit_for(model)
+        # Room left for the model's reply
+        self.reserve_tokens = min(reserve_tokens, self.limit // 4)
+        # Compaction aims below the limit so it does not run again on the next turn
+        self.target_tokens = int(self.limit * target_ratio)
+        self.keep_recent_messages = keep_recent_messages
+        self.max_old_tool_result_chars = max_old_tool_result_chars
+
+        self.fixed_tokens = 0
+        self._tools = None
+        self._history: Optional[list] = None
+        self._costs: List[int] = []
+        self._total = 0
+        self._scale = 1.0
+
+    def _sync(self):
+        """Estimate messages appended since the last call; restart if the history was replaced."""
+        history = self.agent.content_history
+        if history is not self._history or len(history) < len(self._costs):
+            self._history = history
+            self._costs = []
+            self._total = 0
+        for message in history[len(self._costs):]:
+            cost = estimate_tokens(message)
+            self._costs.append(cost)
+            self._total += cost
+
+    def _replace(self, index: int, message):
+        self._history[index] = message
+        cost = estimate_tokens(message)
+        self._total += cost - self._costs[index]
+        self._costs[index] = cost
+
+    @property
+    def tokens(self) -> int:
+        self._sync()
+        return int((self._total + self.fixed_tokens) * self._scale)
+
+    def set_tools(self, tools: List[Dict[str, Any]]):
+        """Account for the tool schemas sent with every request."""
+        if tools is not self._tools:
+            self._tools = tools
+            self.fixed_tokens = len(json.dumps(tools)) // CHARS_PER_TOKEN
+
+    def observe_usage(self, prompt_tokens: int):
+        """Calibrate the estimate against the prompt size the provider reported for the current history."""
+        self._sync()
+        estimated = self._total + self.fixed_tokens
+        if prompt_tokens and estimated:
+            self._scale = prompt_tokens / estimated
+
+    def overflowing(self) -> bool:
+        return self.tokens > self.limit - self.reserve_tokens
+
+    async def ensure_fits(self, summarize: Optional[Callable[[List[Any]], Awaitable[str]]] = None, force: bool = False) -> bool:
+        """Compact the history if the next request would overflow; returns whether it did.
+
+        Steps run cheapest first and stop once under the target: drop file reads
+        superseded by later edits or reads, truncate old tool results, then
+        summarize older turns. With force=True every step runs regardless.
+        """
+        if not force and not self.overflowing():
+            return False
+
+        before = self.tokens
+        self._drop_stale_reads()
+        if force or self.tokens > self.target_tokens:
+            self._truncate_old_tool_results()
+        if force or self.tokens > self.target_tokens:
+            await self._summarize_old_turns(summarize)
+
+        self.agent.compact_history()
+        logger.info(f"Compacted history from ~{before:,} to ~{self.tokens:,} tokens (limit {self.limit:,}).")
+        return True
+
+    def _tool_calls_by_id(self) -> Dict[str, Any]:
+        calls = {}
+        for message in self._history:
+            for tool_call in _field(message, "tool_calls") or []:
+                function = _field(tool_call, "function")
+                calls[_field(tool_call, "id")] = (_field(function, "name"), _field(function, "arguments"))
+        return calls
+
+    def _drop_stale_reads(self):
+        """Blank file reads superseded by a later edit of the file or a later read of the same lines.
+
+        read_file results are blanked whole; read_many_files results per file entry.
+        A later read only supersedes an earlier one if it returned all of its range.
+        """
+        self._sync()
+        calls = self._tool_calls_by_id()
+        # Path -> reads not yet superseded, as (message index, read_many_files entry or None, span)
+        pending: Dict[str, List[Tuple[int, Optional[int], Span]]] = {}
+        stale: Dict[int, Dict[Optional[int], str]] = {}
+
+        def supersede(path: str, span: Span = WHOLE_FILE):
+            kept = []
+            for index, entry, earlier in pending.get(path, []):
+                if _covers(span, earlier):
+                    stale.setdefault(index, {})[entry] = path
+                else:
+                    kept.append((index, entry, earlier))
+            pending[path] = kept
+
+        def add_read(index: int, entry: Optional[int], path: str, span: Span):
+            path = os.path.normpath(path)
+            supersede(path, span)
+            pending.setdefault(path, []).append((index, entry, span))
+
+        for index, message in enumerate(self._history):
+            if _field(message, "role") != "tool":
+                continue
+            name, arguments = calls.get(_field(message, "tool_call_id"), (None, None))
+            try:
+                arguments = json.loads(arguments) if arguments else {}
+            except ValueError:
+                continue
+            if name == READ_TOOL and arguments.get("path"):
+                text = message_text(message)
+                if not text.startswith((STALE_READ_PREFIX, *TOOL_ERROR_PREFIXES)):
+                    add_read(index, None, arguments["path"], _read_file_span(arguments, text))
+            elif name == READ_MANY_TOOL:
+                result = _json_object(message_text(message))
+                for entry, path, span in _read_many_spans(result) if result else []:
+                    add_read(index, entry, path, span)
+            elif name in EDIT_TOOLS:
+                for path in EDITED_FILE_PATTERN.findall(arguments.get("diff_text", "")):
+                    supersede(os.path.normpath(path))
+
+        for index, entries in stale.items():
+            message = self._history[index]
+            replacement = dict(message) if isinstance(message, dict) else {
+                "role": "tool",
+                "tool_call_id": _field(message, "tool_call_id"),
+                "name": _field(message, "name"),
+            }
+            if None in entries:
+                replacement["content"] = f"{STALE_READ_PREFIX} of {entries[None]} omitted: the file was edited or read again later]"
+            else:
+                result = _json_object(message_text(message))
+                for entry, path in entries.items():
+                    result["files"][entry]["content"] = f"{STALE_READ_PREFIX} of {path} omitted: the file was edited or read again later]"
+                replacement["content"] = json.dumps(result, ensure_ascii=False)
+            self._replace(index, replacement)
+
+    def _truncate_old_tool_results(self):
+        """Keep only the head and tail of long tool results outside the recent window."""
+        self._sync()
+        for index in range(max(len(self._history) - self.keep_recent_messages, 0)):
+            message = self._history[index]
+            if _field(message, "role") != "tool":
+                continue
+            text = message_text(message)
+            if len(text) > self.max_old_tool_result_chars:
+                truncated = dict(message) if isinstance(message, dict) else {
+                    "role": "tool",
+                    "tool_call_id": _field(message, "tool_call_id"),
+                    "name": _field(message, "name"),
+                }
+                truncated["content"] = truncate_middle(text, self.max_old_tool_result_chars)
+                self._replace(index, truncated)
+
+    async def _summarize_old_turns(self, summarize: Optional[Callable[[List[Any]], Awaitable[str]]]):
+        """Replace older messages with one summary message, keeping system prompts and recent turns.
+
+        The cut is placed before a user or assistant message so no tool result is
+        separated from the assistant message that requested it.
+        """
+        self._sync()
+        history = self._history
+        start = 0
+        while start < len(history) and _field(history[start], "role") == "system":
+            start += 1
+        cut = len(history) - self.keep_recent_messages
+        while cut > start and _field(history[cut], "role") not in ("user", "assistant"):
+            cut -= 1
+        if cut <= start:
+            return
+
+        old_messages = history[start:cut]
+        summary = None
+        if summarize:
+            try:
+                summary = await summarize(old_messages)
+            except Exception as e:
+                logger.warning(f"Summarizing history failed ({e}); using an extractive summary")
+        if not summary:
+            summary = self._extractive_summary(old_messages)
+
+        history[start:cut] = [{"role": "user", "content": f"[Summary of the earlier conversation]\n{summary}"}]
+        self._costs[start:cut] = [estimate_tokens(history[start])]
+        self._total = sum(self._costs)
+
+    def _extractive_summary(self, messages: List[Any], max_chars: int = 8000) -> str:
+        lines = []
+        for message in messages:
+            role = _field(message, "role")
+            if role == "user":
+                lines.append(f"User: {truncate_middle(message_text(message), 300)}")
+            elif role == "assistant":
+                if message_text(message):
+                    lines.append(f"Assistant: {truncate_middle(message_text(message), 300)}")
+                for tool_call in _field(message, "tool_calls") or []:
+                    function = _field(tool_call, "function")
+                    lines.append(f"Called {_field(function, 'name')}({truncate_middle(str(_field(function, 'arguments')), 150)})")
+        # Prefer the most recent lines when the summary is too long
+        summary = "\n".join(lines)
+        return summary if len(summary) <= max_chars else summary[-max_chars:]
@@ -0,0 +1,76 @@
+#!/usr/bin/env -S PYTHONPATH=. uv run --script
+# /// script
+# dependencies = [ "starlette", "uvicorn" ]
+# ///
+
+"""OpenAI-compatible chat completions server that plays back recorded completions.
+
+Serves POST /v1/chat/completions from an LLM_CACHE_DIR recorded with
+LLM_CACHE_MODE=record or replay, streamed or not as recorded. A request with no
+recording gets a 404, so a run that drifted from the recording fails loudly.
+Point a client at it with:
+
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=stub ./openai_client.py
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from completion_cache import CompletionCache, DEFAULT_LLM_CACHE_DIR, completion_key
+
+logger = logging.getLogger("llm_stub_server")
+
+def _error(status_code: int, message: str, error_type: str) -> JSONResponse:
+    return JSONResponse({"error": {"message": message, "type": error_type}}, status_code=status_code)
+
+def create_app(cache: CompletionCache, chunk_delay: float = 0.0) -> Starlette:
+    """chunk_delay adds a pause between streamed chunks, to mimic a real model's pacing."""
+
+    async def chat_completions(request: Request):
+        try:
+            body = await request.json()
+        except ValueError:
+            return _error(400, "Request body is not valid JSON", "invalid_request_error")
+        key = completion_key(body)
+        entry = await asyncio.to_thread(cache.load, key)
+        if entry is None:
+            logger.warning(f"No recording for request {key} (model {body.get('model')})")
+            return _error(404, f"No recorded completion for request {key}", "not_found_error")
+
+        if "response" in entry:
+            return JSONResponse(entry["response"])
+
+        async def events():
+            for chunk in entry["chunks"]:
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                if chunk_delay:
+                    await asyncio.sleep(chunk_delay)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return Starlette(routes=[Route("/v1/chat/completions", chat_completions, methods=["POST"])])
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recorded LLM completions over the OpenAI API")
+    parser.add_argument("--cache-dir", default=os.getenv("LLM_CACHE_DIR", DEFAULT_LLM_CACHE_DIR), help="Directory of recorded completions")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="Seconds to wait between streamed chunks")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(name)s: %(message)s")
+    app = create_app(CompletionCache(args.cache_dir), chunk_delay=args.chunk_delay)
+    uvicorn.run(app, host=args.host, port=args.port, access_log=False)
+
+if __name__ == "__main__":
+    main()
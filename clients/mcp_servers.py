@@ -0,0 +1,340 @@
+import json
+import asyncio
+import logging
+import pathlib
+from contextlib import AsyncExitStack
+from typing import Any, Callable, Dict, List, Optional
+
+import anyio
+import httpx
+
+from mcp import ClientSession
+from mcp import types as mcp_types
+from mcp.client.streamable_http import streamablehttp_client
+
+logger = logging.getLogger(__name__)
+
+# Looked up from the working directory upwards when no server URL or config is given
+DEFAULT_CONFIG_PATHS = [".cursor/mcp.json", "mcp.json"]
+
+CONNECTION_ERRORS = (
+    httpx.ReadError, httpx.WriteError, httpx.RemoteProtocolError, httpx.ConnectError,
+    anyio.ClosedResourceError, anyio.BrokenResourceError, ConnectionError,
+)
+
+# Tools that always run alone and in order, whatever their annotations say
+SERIAL_TOOLS = {"ask"}
+
+def load_server_config(path: str) -> Dict[str, Dict[str, Any]]:
+    """Read URL-based servers from an mcp.json file ({"mcpServers": {name: {"url", "headers"}}})."""
+    with open(path, "r") as f:
+        config = json.load(f)
+    servers = {}
+    for name, server in config.get("mcpServers", {}).items():
+        if "url" not in server:
+            logger.warning(f"Skipping MCP server '{name}': only URL-based servers are supported")
+            continue
+        servers[name] = {"url": server["url"], "headers": server.get("headers") or {}}
+    return servers
+
+def tool_error(message: str) -> mcp_types.CallToolResult:
+    return mcp_types.CallToolResult(isError=True, content=[mcp_types.TextContent(type="text", text=message)])
+
+def describe_error(error: BaseException) -> str:
+    """The first underlying error of an (anyio) exception group, which says more than the group."""
+    while getattr(error, "exceptions", None):
+        error = error.exceptions[0]
+    return f"{type(error).__name__}: {error}" if str(error) else type(error).__name__
+
+def find_server_config() -> Optional[str]:
+    directory = pathlib.Path.cwd()
+    for parent in [directory, *directory.parents]:
+        for relative_path in DEFAULT_CONFIG_PATHS:
+            if (parent / relative_path).is_file():
+                return str(parent / relative_path)
+    return None
+
+class _SharedTransport(httpx.AsyncBaseTransport):
+    """Routes a session's requests through the pool's transport without closing it with the session."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        pass
+
+class ServerConnection:
+    """One MCP session, owned by a background task so it can be torn down and rebuilt on its own.
+
+    The streams and session are entered and exited inside that task, as anyio
+    requires, so reconnecting one server never touches the others.
+    """
+
+    def __init__(self, name: str, url: str, headers: Dict[str, str], transport: Callable[[], httpx.AsyncBaseTransport], on_tools_changed=None):
+        self.name = name
+        self.url = url
+        self.headers = headers
+        self._transport = transport
+        self._on_tools_changed = on_tools_changed
+        self.session: Optional[ClientSession] = None
+        self.tools: Optional[List[mcp_types.Tool]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing: Optional[asyncio.Event] = None
+        self._lock = asyncio.Lock()
+        # Bumped on every connect, so callers can tell whether the session they used was replaced
+        self.generation = 0
+        # Endpoint URL the server redirected from, whose requests go to self.url instead
+        self._redirected_from: Optional[str] = None
+
+    def _http_client(self, headers=None, timeout=None, auth=None) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            transport=_SharedTransport(self._transport()),
+            headers=headers,
+            timeout=timeout or httpx.Timeout(30.0, read=300.0),
+            auth=auth,
+            follow_redirects=True,
+            event_hooks={"request": [self._skip_known_redirect], "response": [self._remember_redirect]},
+        )
+
+    async def _remember_redirect(self, response: httpx.Response):
+        """Send later requests straight to the endpoint a server redirects the first real one to.
+
+        Servers that mount the MCP app under a prefix redirect /mcp/ to /mcp (or
+        the reverse), which would otherwise cost an extra round trip per message.
+        """
+        location = response.headers.get("location")
+        if response.is_redirect and location and str(response.request.url) == self.url:
+            url = response.url.join(location)
+            if url.host != response.url.host or url.port != response.url.port:
+                return
+            logger.debug(f"MCP server '{self.name}' redirects {self.url} to {url}; using it directly")
+            self._redirected_from, self.url = self.url, str(url)
+
+    async def _skip_known_redirect(self, request: httpx.Request):
+        if self._redirected_from is not None and str(request.url) == self._redirected_from:
+            request.url = httpx.URL(self.url)
+
+    def _streams(self):
+        if self.url.rstrip("/").endswith("/sse"):
+            # Only SSE servers need it, and it pulls in httpx_sse
+            from mcp.client.sse import sse_client
+            return sse_client(url=self.url, headers=self.headers)
+        return streamablehttp_client(url=self.url, headers=self.headers, httpx_client_factory=self._http_client)
+
+    async def _run(self, ready: asyncio.Future):
+        try:
+            async with AsyncExitStack() as stack:
+                streams = await stack.enter_async_context(self._streams())
+                session = await stack.enter_async_context(
+                    ClientSession(streams[0], streams[1], message_handler=self._handle_session_message)
+                )
+                await session.initialize()
+                self.session = session
+                ready.set_result(None)
+                await self._closing.wait()
+        except BaseException as e:
+            if not ready.done():
+                ready.set_exception(e)
+            elif not isinstance(e, asyncio.CancelledError):
+                logger.warning(f"MCP server '{self.name}' disconnected: {describe_error(e)}")
+        finally:
+            self.session = None
+
+    async def connect(self, generation: Optional[int] = None):
+        """(Re)connect this server only, then prefetch its tool list.
+
+        Given the generation of the session a caller saw fail, the server is not
+        reconnected if another caller already replaced that session, which would
+        fail the calls running on the new one.
+        """
+        async with self._lock:
+            if generation is not None and generation != self.generation and self.connected:
+                return
+            await self._close()
+            self._closing = asyncio.Event()
+            ready = asyncio.get_running_loop().create_future()
+            self._task = asyncio.create_task(self._run(ready), name=f"mcp-{self.name}")
+            await ready
+            self.generation += 1
+            logger.debug(f"Connected to MCP server '{self.name}' at {self.url}")
+        await self.list_tools()
+
+    async def _close(self):
+        if self._task is not None:
+            self._closing.set()
+            try:
+                await asyncio.wait_for(self._task, timeout=5)
+            except (asyncio.TimeoutError, Exception):
+                self._task.cancel()
+            self._task = None
+        self.session = None
+        self.tools = None
+
+    async def close(self):
+        async with self._lock:
+            await self._close()
+
+    @property
+    def connected(self) -> bool:
+        return self.session is not None and self._task is not None and not self._task.done()
+
+    async def _handle_session_message(self, message):
+        """Invalidate the cached tool list when the server reports it changed, and notice dead transports."""
+        if isinstance(message, CONNECTION_ERRORS):
+            # Transport errors are delivered here instead of failing the pending request, so end the session
+            logger.warning(f"MCP server '{self.name}' connection failed: {message}")
+            self._closing.set()
+            return
+        if isinstance(message, mcp_types.ServerNotification) and isinstance(message.root, mcp_types.ToolListChangedNotification):
+            logger.debug(f"MCP server '{self.name}' tool list changed, refreshing on next query")
+            self.tools = None
+            if self._on_tools_changed:
+                self._on_tools_changed()
+
+    async def list_tools(self) -> List[mcp_types.Tool]:
+        if self.tools is None:
+            self.tools = (await self.session.list_tools()).tools
+        return self.tools
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any]) -> mcp_types.CallToolResult:
+        if not self.connected:
+            raise ConnectionError(f"MCP server '{self.name}' is not connected")
+        # A request in flight is not failed when the session goes away, so wait on both
+        call = asyncio.ensure_future(self.session.call_tool(name, arguments=arguments))
+        await asyncio.wait({call, self._task}, return_when=asyncio.FIRST_COMPLETED)
+        if call.done():
+            return call.result()
+        call.cancel()
+        raise ConnectionError(f"MCP server '{self.name}' disconnected during the call")
+
+class MCPServerPool:
+    """Concurrent sessions to several MCP servers, with tool calls routed by tool name.
+
+    All sessions share one keep-alive HTTP connection pool. A server whose
+    connection fails is reconnected on its own; the others keep their sessions.
+    """
+
+    def __init__(self, servers: Dict[str, Dict[str, Any]], max_retries: int = 5, retry_delay: float = 1.0):
+        self._transport = self._new_transport()
+        self.servers = {
+            name: ServerConnection(name, server["url"], server.get("headers") or {}, lambda: self._transport, self._invalidate_tools)
+            for name, server in servers.items()
+        }
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        # OpenAI-format tool list across all servers, dropped on reconnect or tools/list_changed
+        self._tools: Optional[List[Dict[str, Any]]] = None
+        # Tool name -> server serving it
+        self._routes: Dict[str, ServerConnection] = {}
+        # Names of tools the servers mark read-only, which may run concurrently
+        self.parallel_tools: set = set()
+
+    @staticmethod
+    def _new_transport() -> httpx.AsyncHTTPTransport:
+        return httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60.0),
+        )
+
+    def _invalidate_tools(self):
+        self._tools = None
+
+    async def _connect_server(self, server: ServerConnection, generation: Optional[int] = None) -> bool:
+        try:
+            await server.connect(generation)
+            return True
+        except Exception as e:
+            logger.warning(f"Could not connect to MCP server '{server.name}' at {server.url}: {describe_error(e)}")
+            return False
+        finally:
+            self._invalidate_tools()
+
+    async def connect(self) -> int:
+        """Connect to every server concurrently; returns how many are connected."""
+        results = await asyncio.gather(*(self._connect_server(server) for server in self.servers.values()))
+        return sum(results)
+
+    async def reconnect_disconnected(self) -> int:
+        """Reconnect only the servers whose sessions are gone; returns how many were reconnected."""
+        disconnected = [(server, server.generation) for server in self.servers.values() if not server.connected]
+        results = await asyncio.gather(*(self._connect_server(server, generation) for server, generation in disconnected))
+        return sum(results)
+
+    async def _reconnect(self, server: ServerConnection, generation: int):
+        for attempt in range(1, self.max_retries + 1):
+            logger.warning(f"Reconnecting to MCP server '{server.name}' ({attempt}/{self.max_retries})...")
+            if await self._connect_server(server, generation):
+                return
+            await asyncio.sleep(self.retry_delay)
+        raise ConnectionError(f"Reconnecting to MCP server '{server.name}' failed after {self.max_retries} attempts")
+
+    async def get_tools(self) -> List[Dict[str, Any]]:
+        """Return the tools of all connected servers as OpenAI function schemas, cached until they change.
+
+        When two servers offer a tool with the same name, the first server in the config wins.
+        """
+        if self._tools is None:
+            await self.reconnect_disconnected()
+
+            tools, routes, parallel_tools = [], {}, set()
+            for server in self.servers.values():
+                if not server.connected:
+                    continue
+                for tool in await server.list_tools():
+                    if tool.name in routes:
+                        logger.warning(f"Tool '{tool.name}' of MCP server '{server.name}' is shadowed by '{routes[tool.name].name}'")
+                        continue
+                    routes[tool.name] = server
+                    tools.append({
+                        "type": "function",
+                        "function": {
+                            "name": tool.name,
+                            "description": tool.description,
+                            "parameters": {
+                                k: v
+                                for k, v in tool.inputSchema.items()
+                                if k not in ["additionalProperties", "$schema", "title"]
+                            }
+                        }
+                    })
+                    if tool.annotations and tool.annotations.readOnlyHint and tool.name not in SERIAL_TOOLS:
+                        parallel_tools.add(tool.name)
+            self._tools, self._routes, self.parallel_tools = tools, routes, parallel_tools
+        return self._tools
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any]) -> mcp_types.CallToolResult:
+        """Call a tool on the server that offers it, reconnecting that server if its connection broke.
+
+        Only read-only tools are called again after a reconnect; for others the
+        failure is returned as a tool error.
+        """
+        if self._tools is None:
+            await self.get_tools()
+        server = self._routes.get(name)
+        if server is None:
+            # Reported to the model like any failed call, so a made-up tool name does not end the session
+            return tool_error(f"No connected MCP server offers tool '{name}'")
+        generation = server.generation
+        try:
+            return await server.call_tool(name, arguments)
+        except CONNECTION_ERRORS as e:
+            logger.warning(f"Call to '{name}' on MCP server '{server.name}' failed: {e}")
+            await self._reconnect(server, generation)
+            if name not in self.parallel_tools:
+                # The request may have reached the server and only the response been lost, so
+                # running a tool that changes state again could apply it twice
+                return tool_error(
+                    f"The connection to MCP server '{server.name}' broke during the call to '{name}', which may "
+                    f"or may not have been applied; check its effect before calling it again"
+                )
+            return await server.call_tool(name, arguments)
+
+    async def close(self):
+        """Close every session and the connection pool; connect() may be called again afterwards."""
+        await asyncio.gather(*(server.close() for server in self.servers.values()))
+        self._tools = None
+        await self._transport.aclose()
+        self._transport = self._new_transport()
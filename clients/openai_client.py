@@ -1,37 +1,47 @@
 #!/usr/bin/env -S PYTHONPATH=. uv run --script
 # /// script
-# dependencies = [ "mcp[cli]", "openai", "httpx", "anyio", "prompt_toolkit", "jsonpickle"]
+# dependencies = [ "mcp[cli]>=1.10.0,<2", "openai", "httpx", "anyio", "prompt_toolkit", "jsonpickle"]
 # ///
 
 import asyncio
+import contextlib
+import importlib
 import logging
 import os
+import random
 import sys
+import threading
+import time
 import functools
-from typing import Optional, Callable, Awaitable, TypeVar, List, Dict, Any, Tuple
-from contextlib import AsyncExitStack
+from typing import TYPE_CHECKING, Optional, Callable, Awaitable, TypeVar, List, Dict, Any, Tuple, Union
 import argparse
 
 import httpx
 import anyio
 
-# Import prompt_toolkit
-from prompt_toolkit import PromptSession, print_formatted_text
-from prompt_toolkit.patch_stdout import patch_stdout
-from prompt_toolkit.formatted_text import FormattedText
-from prompt_toolkit.styles import Style
-
 import json
-from openai import OpenAI
 
-from mcp import ClientSession
-from mcp.client.sse import sse_client
+from mcp import types as mcp_types
+
+# openai and prompt_toolkit are imported on first use: together they are most of the
+# client's startup time, and neither is needed to connect to the MCP servers
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from completion_cache import CachingProvider
 
 from agent import Agent
+from blob_store import BlobStore, READ_TOOL_RESULT, READ_TOOL_RESULT_SCHEMA
+from context_window import ContextWindow, is_context_overflow, message_text, truncate_middle
+from mcp_servers import MCPServerPool, describe_error, find_server_config, load_server_config, tool_error
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Backoff on rate-limited completion requests, on top of the SDK's own retries
+RATE_LIMIT_RETRIES = 6
+RATE_LIMIT_BACKOFF_BASE = 2.0
+RATE_LIMIT_BACKOFF_MAX = 60.0
+
 # Define prompt_toolkit styles dictionary
 PROMPT_STYLE_DICT = {
     "prompt": "fg:yellow",
@@ -42,8 +52,25 @@ PROMPT_STYLE_DICT = {
     "output.debug": "fg:gray",
 }
 
-# Create Style object from the dictionary
-PROMPT_STYLE_OBJ = Style.from_dict(PROMPT_STYLE_DICT)
+# Style object from the dictionary, created on first use
+@functools.lru_cache(maxsize=None)
+def prompt_style():
+    from prompt_toolkit.styles import Style
+    return Style.from_dict(PROMPT_STYLE_DICT)
+
+def prompt_message(text: str):
+    from prompt_toolkit.formatted_text import FormattedText
+    return FormattedText([("class:prompt", text)])
+
+# Imported in the background while the user types the first query
+DEFERRED_IMPORTS = ["openai"]
+
+def warm_deferred_imports():
+    """Import the deferred modules on a daemon thread, so the first query does not wait for them."""
+    def run():
+        for name in DEFERRED_IMPORTS:
+            importlib.import_module(name)
+    threading.Thread(target=run, name="warm-imports", daemon=True).start()
 
 # Custom logging handler integrating with prompt_toolkit
 class PromptToolkitLogHandler(logging.Handler):
@@ -95,8 +122,11 @@ def setup_logging(debug: bool = False):
 
 # Helper to print formatted text using prompt_toolkit
 def print_pt(text: str, style_class: str = ""):
+    from prompt_toolkit import print_formatted_text
+    from prompt_toolkit.formatted_text import FormattedText
+
     if style_class:
-        print_formatted_text(FormattedText([(f"class:{style_class}", text)]), style=PROMPT_STYLE_OBJ)
+        print_formatted_text(FormattedText([(f"class:{style_class}", text)]), style=prompt_style())
     else:
         # Print with default style if no class specified
         print_formatted_text(text)
@@ -155,39 +185,123 @@ def truncate_text_both_ends(text: str, max_length: int = 250):
     else:
         return text[:max_length//2] + "..." + text[-max_length//2:]
 
-class MCPClient:
-    def __init__(self, server_url: str):
-        self.exit_stack = AsyncExitStack() # Use one stack for the lifetime
-        self._stop_event = asyncio.Event() # Event to signal shutdown
+def create_provider():
+    """OpenAI-compatible client for the provider configured in the environment.
 
-        self.server_url = server_url # Store the server URL for reconnection
-        self._sse_stream_context = None
-        self.sse_stream = None
+    With LLM_CACHE_MODE set, completions are recorded to or replayed from LLM_CACHE_DIR.
+    """
+    mode = os.getenv("LLM_CACHE_MODE")
+    if not mode:
+        return _create_upstream_provider()
+    from completion_cache import CachingProvider, CompletionCache, DEFAULT_LLM_CACHE_DIR
+
+    cache = CompletionCache(os.getenv("LLM_CACHE_DIR", DEFAULT_LLM_CACHE_DIR))
+    # In replay-or-fail mode everything comes from the cache, so no credentials are needed
+    upstream = None if mode == "replay-or-fail" else _create_upstream_provider()
+    return CachingProvider(upstream, mode, cache)
+
+def _create_upstream_provider() -> "AsyncOpenAI":
+    from openai import AsyncOpenAI
+
+    if os.getenv("GOOGLE_VERTEX_PROJECT") and os.getenv("GOOGLE_VERTEX_LOCATION"):
+        base_url = f"https://{os.getenv('GOOGLE_VERTEX_LOCATION')}-aiplatform.googleapis.com/v1beta1/projects/{os.getenv('GOOGLE_VERTEX_PROJECT')}/locations/{os.getenv('GOOGLE_VERTEX_LOCATION')}/endpoints/openapi"
+        return AsyncOpenAI(
+            base_url=base_url
+        )
+    elif os.getenv("GEMINI_API_KEY"):
+        return AsyncOpenAI(
+            api_key=os.getenv("GEMINI_API_KEY"),
+            base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
+        )
+    elif os.getenv("ANTHROPIC_API_KEY"):
+        return AsyncOpenAI(
+            api_key=os.getenv("ANTHROPIC_API_KEY"),
+            base_url="https://api.anthropic.com/v1/"
+        )
+    else:
+        return AsyncOpenAI()
 
-        self._mcp_session_context = None
-        self.mcp_session: Optional[ClientSession] = None
+def _retry_after(error: Exception) -> Optional[float]:
+    """Seconds the provider asked us to wait, if it said."""
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
 
-        self.prompt_session = PromptSession(history=None)
+class ToolCallDispatcher:
+    """Starts tool calls as soon as they are submitted, preserving ordering constraints.
 
-        if os.getenv("GOOGLE_VERTEX_PROJECT") and os.getenv("GOOGLE_VERTEX_LOCATION"):
-            base_url = f"https://{os.getenv('GOOGLE_VERTEX_LOCATION')}-aiplatform.googleapis.com/v1beta1/projects/{os.getenv('GOOGLE_VERTEX_PROJECT')}/locations/{os.getenv('GOOGLE_VERTEX_LOCATION')}/endpoints/openapi"
-            self.provider = OpenAI(
-                base_url=base_url
-            )
-        elif os.getenv("GEMINI_API_KEY"):
-            self.provider = OpenAI(
-                api_key=os.getenv("GEMINI_API_KEY"),
-                base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
-            )
-        elif os.getenv("ANTHROPIC_API_KEY"):
-            self.provider = OpenAI(
-                api_key=os.getenv("ANTHROPIC_API_KEY"),
-                base_url="https://api.anthropic.com/v1/"
-            )
+    A parallel call only waits for the last serial call submitted before it; a
+    serial call waits for every call submitted before it. Results are returned
+    in submission order. A call that raises yields an error result instead, so
+    every tool call gets a tool message.
+    """
+
+    def __init__(self, call: Callable[[Dict[str, Any]], Awaitable[Any]]):
+        self._call = call
+        self._tasks: List[asyncio.Task] = []
+        self._last_serial: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def submit(self, tool_call: Dict[str, Any], parallel: bool):
+        if parallel:
+            dependencies = [self._last_serial] if self._last_serial else []
         else:
-            self.provider = OpenAI()
+            dependencies = list(self._tasks)
+        task = asyncio.create_task(self._run(dependencies, tool_call))
+        if not parallel:
+            self._last_serial = task
+        self._tasks.append(task)
+
+    async def _run(self, dependencies: List[asyncio.Task], tool_call: Dict[str, Any]):
+        if dependencies:
+            await asyncio.wait(dependencies)
+        try:
+            return await self._call(tool_call)
+        except Exception as e:
+            print_pt(f"[ERROR] Tool call {tool_call['function']['name']} failed: {e}", "output.error")
+            return tool_error(f"Tool call failed: {describe_error(e)}")
+
+    async def results(self) -> List[Any]:
+        return await asyncio.gather(*self._tasks)
+
+class MCPClient:
+    def __init__(
+        self,
+        servers: Union[Dict[str, Dict[str, Any]], MCPServerPool],
+        max_parallel_tool_calls: int = 4,
+        provider: Optional[Union["AsyncOpenAI", "CachingProvider"]] = None,
+        agent: Optional[Agent] = None,
+        llm_semaphore: Optional[asyncio.Semaphore] = None,
+        interactive: bool = True,
+    ):
+        # One session per configured server ({name: {"url", "headers"}}), sharing a keep-alive connection pool.
+        # Headless sessions pass one already-connected pool so they all share it.
+        self.servers = servers if isinstance(servers, MCPServerPool) else MCPServerPool(servers)
+        self._tool_semaphore = asyncio.Semaphore(max(max_parallel_tool_calls, 1))
+        # Server tools plus the client-side read_tool_result, rebuilt when the server list changes
+        self._server_tools: Optional[List[Dict[str, Any]]] = None
+        self._tools: List[Dict[str, Any]] = []
+
+        # Large tool results are kept here and referenced from the history by digest
+        self.blobs = BlobStore()
+
+        if interactive:
+            from prompt_toolkit import PromptSession
+            self.prompt_session = PromptSession(history=None)
+        else:
+            self.prompt_session = None
+
+        # Created on first use, so connecting does not wait for the openai import
+        self._provider = provider
+        # Caps LLM requests in flight across every session sharing the semaphore
+        self._llm_slots = llm_semaphore or contextlib.nullcontext()
+        # Per-session counters, reported by the batch runner
+        self.stats = {"llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "tool_calls": 0, "rate_limited": 0}
 
-        self.agent = Agent()
+        self.agent = agent or Agent()
         if len(self.agent.content_history) == 0:
             print_pt("[WARNING] Adding system instruction to content history...", "output.warning")
             self.agent.content_history.append({
@@ -195,19 +309,192 @@ class MCPClient:
                 "content": self.agent.system_instruction
             })
 
+        self.context = ContextWindow(self.agent, os.getenv("MAIN_MODEL"))
+
+    @property
+    def provider(self):
+        if self._provider is None:
+            self._provider = create_provider()
+        return self._provider
+
     async def _connect_internal(self):
         """Internal logic to establish a connection."""
         await self.cleanup()
-        self.exit_stack = AsyncExitStack()
 
-        self._sse_stream_context = sse_client(url=self.server_url)
-        self.sse_stream = await self.exit_stack.enter_async_context(self._sse_stream_context)
+        connected = await self.servers.connect()
+        if not connected:
+            raise ConnectionError("Could not connect to any MCP server")
+        print_pt(f"[DEBUG] Initialized MCP sessions with {connected}/{len(self.servers.servers)} servers...", "output.debug")
+
+        # Prefetch so the first query does not pay for the tools/list round trip
+        await self.get_tools()
+
+    async def get_tools(self) -> List[Dict[str, Any]]:
+        """Return the tools of every connected server as OpenAI function schemas, cached until they change."""
+        server_tools = await self.servers.get_tools()
+        if server_tools is not self._server_tools:
+            self._server_tools = server_tools
+            self._tools = server_tools + [READ_TOOL_RESULT_SCHEMA]
+        return self._tools
+
+    def _read_tool_result(self, arguments: Dict[str, Any]) -> mcp_types.CallToolResult:
+        text = self.blobs.read_lines(arguments.get("digest", ""), arguments.get("offset", 0), arguments.get("limit", 400))
+        return mcp_types.CallToolResult(content=[mcp_types.TextContent(type="text", text=text)])
+
+    def _history_content(self, tool_name: str, tool_result: mcp_types.CallToolResult):
+        """Content to keep in the history for a tool result: large text results are replaced by a blob reference."""
+        parts = tool_result.content
+        if tool_name == READ_TOOL_RESULT or not all(isinstance(part, mcp_types.TextContent) for part in parts):
+            return parts
+        text = "\n".join(part.text for part in parts)
+        if len(text) <= self.blobs.inline_chars:
+            return parts
+        return self.blobs.spill(text)
+
+    async def _call_tool(self, tool_call: Dict[str, Any]):
+        """Call one tool on the MCP server and log its timing."""
+        function_call = tool_call["function"]
+        async with self._tool_semaphore:
+            print_pt(f"[TOOL] Function call: {function_call['name']}, args: {truncate_text_both_ends(str(function_call['arguments']))}", "output.tool")
+
+            start = time.perf_counter()
+            self.stats["tool_calls"] += 1
+            arguments = json.loads(function_call["arguments"] or "{}")
+            if function_call["name"] == READ_TOOL_RESULT:
+                tool_result = self._read_tool_result(arguments)
+            else:
+                tool_result = await self.servers.call_tool(function_call["name"], arguments)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        print_pt(f"[TOOL] Tool result ({function_call['name']}, {elapsed_ms:.0f} ms): {truncate_text_both_ends(str(tool_result))}", "output.tool")
+        return tool_result
+
+    def _dispatch_tool_call(self, dispatcher: ToolCallDispatcher, tool_call: Dict[str, Any]):
+        name = tool_call["function"]["name"]
+        dispatcher.submit(tool_call, parallel=name in self.servers.parallel_tools or name == READ_TOOL_RESULT)
+
+    async def _summarize_messages(self, messages: List[Any]) -> str:
+        """Summarize older history messages with the main model, for context compaction."""
+        transcript = "\n\n".join(
+            f"{message['role'] if isinstance(message, dict) else message.role}: {truncate_middle(message_text(message), 2000)}"
+            for message in messages
+        )
+        async with self._llm_slots:
+            response = await self._create_completion(
+                model=os.getenv("MAIN_MODEL"),
+                messages=[
+                    {
+                        "role": "system",
+                        "content": "Summarize this conversation between a user and an AI agent using tools. Keep the user's goals, decisions made, files touched and their current state, and open tasks. Be concise."
+                    },
+                    {"role": "user", "content": truncate_middle(transcript, self.context.limit * 2)},
+                ],
+                temperature=0.1,
+            )
+        return response.choices[0].message.content
 
-        self._mcp_session_context = ClientSession(*self.sse_stream)
-        self.mcp_session: ClientSession = await self.exit_stack.enter_async_context(self._mcp_session_context)
+    async def _create_completion(self, **kwargs):
+        """chat.completions.create, backing off exponentially (or as told by retry-after) when rate limited."""
+        from openai import RateLimitError
 
-        await self.mcp_session.initialize()
-        print_pt(f"[DEBUG] Initialized SSE and MCP sessions...", "output.debug")
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            try:
+                return await self.provider.chat.completions.create(**kwargs)
+            except RateLimitError as e:
+                if attempt == RATE_LIMIT_RETRIES:
+                    raise
+                self.stats["rate_limited"] += 1
+                delay = _retry_after(e) or min(RATE_LIMIT_BACKOFF_BASE * 2 ** attempt, RATE_LIMIT_BACKOFF_MAX) * random.uniform(0.5, 1.0)
+                print_pt(f"[WARNING] Rate limited; retrying in {delay:.1f}s ({attempt + 1}/{RATE_LIMIT_RETRIES})", "output.warning")
+                await asyncio.sleep(delay)
+
+    async def _stream_completion(self, tools: List[Dict[str, Any]], dispatcher: ToolCallDispatcher) -> Dict[str, Any]:
+        """Stream one model turn, printing text as it arrives and dispatching tool calls early.
+
+        A tool call is dispatched as soon as its arguments are complete, i.e. when
+        the next call starts or the stream ends. Returns the assistant message.
+        """
+        # The slot is held until the stream is consumed, since that is when the provider is done with the request
+        async with self._llm_slots:
+            return await self._stream_turn(tools, dispatcher)
+
+    async def _stream_turn(self, tools: List[Dict[str, Any]], dispatcher: ToolCallDispatcher) -> Dict[str, Any]:
+        start = time.perf_counter()
+        first_token_at = None
+        text_parts: List[str] = []
+        pending_line = ""
+        tool_calls: Dict[int, Dict[str, Any]] = {}
+        dispatched = 0
+        usage = None
+
+        stream = await self._create_completion(
+            model=os.getenv("MAIN_MODEL"),
+            messages=self.agent.content_history,
+            temperature=0.1,
+            tools=tools,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        async for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+
+            if (delta.content or delta.tool_calls) and first_token_at is None:
+                first_token_at = time.perf_counter()
+
+            if delta.content:
+                text_parts.append(delta.content)
+                *lines, pending_line = (pending_line + delta.content).split("\n")
+                for line in lines:
+                    print_pt(line, "output.model")
+
+            for tool_call_delta in delta.tool_calls or []:
+                index = tool_call_delta.index if tool_call_delta.index is not None else len(tool_calls)
+                if index not in tool_calls:
+                    # A new call starting means the arguments of every earlier call are complete
+                    for earlier in sorted(tool_calls)[dispatched:]:
+                        self._dispatch_tool_call(dispatcher, tool_calls[earlier])
+                        dispatched += 1
+                    tool_calls[index] = {"id": None, "type": "function", "function": {"name": "", "arguments": ""}}
+                tool_call = tool_calls[index]
+                if tool_call_delta.id:
+                    tool_call["id"] = tool_call_delta.id
+                if tool_call_delta.function:
+                    if tool_call_delta.function.name:
+                        tool_call["function"]["name"] = tool_call_delta.function.name
+                    if tool_call_delta.function.arguments:
+                        tool_call["function"]["arguments"] += tool_call_delta.function.arguments
+
+        if pending_line:
+            print_pt(pending_line, "output.model")
+        for index in sorted(tool_calls):
+            tool_calls[index]["id"] = tool_calls[index]["id"] or f"call_{index}"
+        for earlier in sorted(tool_calls)[dispatched:]:
+            self._dispatch_tool_call(dispatcher, tool_calls[earlier])
+
+        end = time.perf_counter()
+        text = "".join(text_parts)
+        if usage:
+            self.context.observe_usage(usage.prompt_tokens)
+            completion_tokens = usage.completion_tokens
+            self.stats["prompt_tokens"] += usage.prompt_tokens
+        else:
+            # Rough estimate when the provider does not report usage for streams
+            completion_tokens = (len(text) + sum(len(call["function"]["arguments"]) for call in tool_calls.values())) // 4
+        self.stats["llm_calls"] += 1
+        self.stats["completion_tokens"] += completion_tokens
+        ttft = (first_token_at or end) - start
+        generation_time = end - (first_token_at or start)
+        tokens_per_second = completion_tokens / generation_time if generation_time > 0 else 0.0
+        total = f"{usage.total_tokens:,} / {self.context.limit:,}, " if usage else f"~{self.context.tokens:,} / {self.context.limit:,}, "
+        print_pt(f"[WARNING] Token usage: {total}TTFT {ttft:.2f}s, {completion_tokens} tokens at {tokens_per_second:.1f} tok/s", "output.warning")
+
+        message: Dict[str, Any] = {"role": "assistant", "content": text or None}
+        if tool_calls:
+            message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+        return message
 
     @retryable(max_retries=5, delay=1)
     async def connect(self):
@@ -221,38 +508,98 @@ class MCPClient:
             raise
 
     async def cleanup(self):
-        """Properly clean up the session, streams, and background task."""
+        """Close every server session and the shared connection pool."""
         print_pt(f"[DEBUG] Initiating client cleanup...", "output.debug")
-        self._stop_event.set()
-        await self.exit_stack.aclose()
-        self._mcp_session_context = None
-        self.mcp_session = None
-        self._sse_stream_context = None
-        self.sse_stream = None
+        await self.servers.close()
         print_pt(f"[DEBUG] Client cleanup complete.", "output.debug")
 
+    async def _next_message(self, tools: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], ToolCallDispatcher]:
+        """Fit the history into the context window, then stream and record the next assistant message.
+
+        Returns the message and the dispatcher already running its tool calls.
+        """
+        from openai import BadRequestError
+
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            print_pt(f"[DEBUG] Content History: {self.agent.content_history}", "output.debug")
+
+        self.context.set_tools(tools)
+        await self.context.ensure_fits(self._summarize_messages)
+
+        dispatcher = ToolCallDispatcher(self._call_tool)
+        try:
+            message = await self._stream_completion(tools, dispatcher)
+        except BadRequestError as e:
+            if not is_context_overflow(e):
+                # Compacting would cost the conversation and not fix a malformed request
+                print_pt(f"[ERROR] Request rejected: {e}", "output.error")
+                raise
+            # The prompt outgrew the context window despite the estimate; compact hard and retry once
+            print_pt(f"[WARNING] Request rejected ({e}). Compacting history and retrying...", "output.warning")
+            await self.context.ensure_fits(self._summarize_messages, force=True)
+            dispatcher = ToolCallDispatcher(self._call_tool)
+            message = await self._stream_completion(tools, dispatcher)
+        except Exception as e:
+            print_pt(f"[ERROR] Error generating content: {e}", "output.error")
+            print_pt(str(self.agent.content_history), "output.error")
+            raise
+
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            print_pt(f"[DEBUG] Model response: {message}", "output.debug")
+
+        if not message["content"] and not message.get("tool_calls"):
+            print_pt("[ERROR] No content received from OpenAI API", "output.error")
+
+        self.agent.add_content(message)
+        self.agent.save_history()
+        return message, dispatcher
+
+    def _add_tool_result(self, tool_call: Dict[str, Any], tool_result: mcp_types.CallToolResult):
+        function_call = tool_call["function"]
+        self.agent.add_content(
+            {
+                "role": "tool",
+                "tool_call_id": tool_call["id"],
+                "name": function_call["name"],
+                "content": self._history_content(function_call["name"], tool_result)
+            }
+        )
+
+    async def run_task(self, query: str, max_turns: int = 50) -> Dict[str, Any]:
+        """Run one task without a user, for batch runs.
+
+        Stops when the model replies without calling tools ("done"), calls the
+        'ask' tool ("needs_input", with its question as the result), or uses up
+        max_turns model turns ("max_turns").
+        """
+        tools = await self.get_tools()
+        self.agent.add_content({"role": "user", "content": query})
+
+        last_text = ""
+        for turn in range(1, max_turns + 1):
+            message, dispatcher = await self._next_message(tools)
+            last_text = message["content"] or last_text
+            if not message.get("tool_calls"):
+                return {"status": "done", "result": last_text, "turns": turn}
+
+            question = None
+            tool_results = await dispatcher.results()
+            for tool_call, tool_result in zip(message["tool_calls"], tool_results):
+                self._add_tool_result(tool_call, tool_result)
+                if tool_call["function"]["name"] == "ask":
+                    question = message_text(tool_result)
+            self.agent.save_history()
+            if question is not None:
+                return {"status": "needs_input", "result": question, "turns": turn}
+
+        return {"status": "max_turns", "result": last_text, "turns": max_turns}
+
     async def inlined_process_query_recursive(self, query: str):
         if query == "":
             print("No query provided.")
             return
 
-        mcp_tools = await self.mcp_session.list_tools()
-
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": tool.name,
-                    "description": tool.description,
-                    "parameters": {
-                        k: v 
-                        for k, v in tool.inputSchema.items()
-                        if k not in ["additionalProperties", "$schema", "title"]
-                    }
-                }
-            }
-            for tool in mcp_tools.tools
-        ]
+        tools = await self.get_tools()
 
         self.agent.add_content(
             {
@@ -262,66 +609,21 @@ class MCPClient:
         )
 
         while True:
-            if logging.getLogger().isEnabledFor(logging.DEBUG):
-                print_pt(f"[DEBUG] Content History: {self.agent.content_history}", "output.debug")
-
-            try:
-                response = self.provider.chat.completions.create(
-                    model=os.getenv("MAIN_MODEL"),
-                    messages=self.agent.content_history,
-                    temperature=0.1,
-                    tools=tools,
-                )
-            except Exception as e:
-                print_pt(f"[ERROR] Error generating content: {e}", "output.error")
-                print_pt(str(self.agent.content_history), "output.error")
-
-                if e.error.code == 400:
-                    raise Exception("Token limit exceeded. Forgetting history?")
+            message, dispatcher = await self._next_message(tools)
 
-                raise
-
-            if logging.getLogger().isEnabledFor(logging.DEBUG):
-                print_pt(f"[DEBUG] Gemini response: {response}", "output.debug")
-
-            print_pt(f"[WARNING] Token usage: {response.usage.total_tokens} / 1,047,576", "output.warning")
+            if message.get("tool_calls"):
+                tool_results = await dispatcher.results()
+                for tool_call, tool_result in zip(message["tool_calls"], tool_results):
+                    function_call = tool_call["function"]
 
-            candidate = response.choices[0]
+                    self._add_tool_result(tool_call, tool_result)
 
-            if not candidate.message:
-                print_pt("[ERROR] No content received from OpenAI API", "output.error")
-                print_pt(str(response), "output.error")
-
-            self.agent.add_content(candidate.message)
-            self.agent.save_history()
-
-            if candidate.message.tool_calls:
-                for tool_call in candidate.message.tool_calls:
-                    function_call = tool_call.function
-                
-                    print_pt(f"[TOOL] Function call: {function_call.name}, args: {truncate_text_both_ends(str(function_call.arguments))}", "output.tool")
-
-                    tool_result = await self.mcp_session.call_tool(
-                        function_call.name,
-                        arguments=json.loads(function_call.arguments),
-                    )
-                    print_pt(f"[TOOL] Tool result: {truncate_text_both_ends(str(tool_result))}", "output.tool")
-
-                    self.agent.add_content(
-                        {
-                            "role": "tool",
-                            "tool_call_id": tool_call.id,
-                            "name": function_call.name,
-                            "content": tool_result.content
-                        }
-                    )
-
-                    if function_call.name == "ask":
+                    if function_call["name"] == "ask":
                         # get user input
                         print(f"Model (clarification): {tool_result.content[0].text}")
                         answer = await self.prompt_session.prompt_async(
-                            FormattedText([("class:prompt", "User (clarification): ")]),
-                            style=PROMPT_STYLE_OBJ
+                            prompt_message("User (clarification): "),
+                            style=prompt_style()
                         )
 
                         self.agent.add_content(
@@ -344,7 +646,7 @@ class MCPClient:
 
     async def chat_loop(self):
         """Run an interactive chat loop using prompt_toolkit"""
-        prompt_session = PromptSession(history=None)
+        warm_deferred_imports()
         print_pt(f"MCP Client Started! (Using prompt_toolkit)")
         print_pt(f"Type your queries or 'quit' to exit.")
 
@@ -354,8 +656,8 @@ class MCPClient:
             try:
                 # Use prompt_async with the Style object
                 query = await self.prompt_session.prompt_async(
-                    FormattedText([("class:prompt", "User: ")]),
-                    style=PROMPT_STYLE_OBJ
+                    prompt_message("User: "),
+                    style=prompt_style()
                 )
                 query = query.strip()
 
@@ -366,7 +668,7 @@ class MCPClient:
 
             except anyio.ClosedResourceError:
                 print_pt(f"Connection closed. Attempting to reconnect...", "output.debug")
-                await self.connect()
+                await self.servers.reconnect_disconnected()
 
                 await self.inlined_process_query_recursive(query)
 
@@ -377,22 +679,34 @@ class MCPClient:
 async def main():
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='MCP Client')
-    parser.add_argument('server_url', help='URL of SSE MCP server (i.e. http://localhost:8080/sse)')
+    parser.add_argument('server_url', nargs='?', help='URL of a single MCP server (i.e. http://localhost:8002/filesystem/mcp); SSE if it ends in /sse')
+    parser.add_argument('--config', help='mcp.json file listing the servers to connect to (default: .cursor/mcp.json or mcp.json, searched upwards)')
     parser.add_argument('--debug', action='store_true', help='Enable debug logging')
+    parser.add_argument('--max-parallel-tools', type=int, default=4, help='Maximum read-only tool calls to run concurrently')
     args = parser.parse_args()
 
     # Setup logging as the very first thing
     setup_logging(debug=args.debug)
 
-    server_url = args.server_url
-    logging.info(f"MCP Client attempting to connect to: {server_url}")
-    client = MCPClient(server_url=server_url)
+    if args.server_url:
+        servers = {"default": {"url": args.server_url}}
+    else:
+        config_path = args.config or find_server_config()
+        if not config_path:
+            parser.error("Pass a server URL or --config, or add a .cursor/mcp.json")
+        servers = load_server_config(config_path)
+        if not servers:
+            parser.error(f"No URL-based MCP servers in {config_path}")
+    logging.info(f"MCP Client attempting to connect to: {', '.join(server['url'] for server in servers.values())}")
+    client = MCPClient(servers=servers, max_parallel_tool_calls=args.max_parallel_tools)
     try:
         if not await client.connect():
             logging.error(f"Initial connection failed. Exiting.")
             # print_pt already happens within connect on failure
             sys.exit(1)
         
+        from prompt_toolkit.patch_stdout import patch_stdout
+
         # Use patch_stdout context manager
         with patch_stdout():
             await client.chat_loop()
@@ -0,0 +1,61 @@
+import json
+from types import SimpleNamespace
+
+from blob_store import BlobStore
+from context_window import STALE_READ_PREFIX, ContextWindow, is_context_overflow
+
+def _history_with_calls(calls):
+    """Assistant tool calls each followed by its result, as the client records them."""
+    history = []
+    for number, (name, arguments, content) in enumerate(calls):
+        call_id = f"call_{number}"
+        history.append({"role": "assistant", "content": None, "tool_calls": [
+            {"id": call_id, "type": "function", "function": {"name": name, "arguments": json.dumps(arguments)}},
+        ]})
+        history.append({"role": "tool", "tool_call_id": call_id, "name": name, "content": content})
+    return history
+
+def _ranged_result(path, offset, next_offset, content):
+    return json.dumps({"path": path, "unit": "lines", "offset": offset, "next_offset": next_offset, "eof": False, "content": content})
+
+def _drop_stale_reads(history):
+    ContextWindow(SimpleNamespace(content_history=history), "gpt-4o")._drop_stale_reads()
+    return [message["content"] for message in history if message["role"] == "tool"]
+
+def test_spilled_ranged_read_keeps_reads_of_other_ranges(tmp_path):
+    spilled = BlobStore(str(tmp_path), inline_chars=100).spill(_ranged_result("app.py", 400, 900, "x = 1\n" * 100))
+    contents = _drop_stale_reads(_history_with_calls([
+        ("read_file", {"path": "app.py", "offset": 0, "limit": 50}, _ranged_result("app.py", 0, 50, "head")),
+        ("read_file", {"path": "app.py", "offset": 400, "limit": 500}, spilled),
+    ]))
+    assert not contents[0].startswith(STALE_READ_PREFIX)
+
+def test_spilled_whole_read_keeps_earlier_reads(tmp_path):
+    spilled = BlobStore(str(tmp_path), inline_chars=100).spill("x = 1\n" * 100)
+    contents = _drop_stale_reads(_history_with_calls([
+        ("read_file", {"path": "app.py", "offset": 0, "limit": 50}, _ranged_result("app.py", 0, 50, "head")),
+        ("read_file", {"path": "app.py"}, spilled),
+    ]))
+    assert not contents[0].startswith(STALE_READ_PREFIX)
+
+def test_covering_read_and_edit_make_reads_stale():
+    edit = "```diff\nlib.py\n<<<<<<< SEARCH\na\n=======\nb\n>>>>>>> REPLACE\n```"
+    contents = _drop_stale_reads(_history_with_calls([
+        ("read_file", {"path": "app.py", "offset": 10, "limit": 5}, _ranged_result("app.py", 10, 15, "middle")),
+        ("read_file", {"path": "lib.py"}, "a\n"),
+        ("read_file", {"path": "app.py", "offset": 0, "limit": 50}, _ranged_result("app.py", 0, 50, "head")),
+        ("diff_fenced_edit_file", {"diff_text": edit}, '{"success": true}'),
+    ]))
+    assert contents[0].startswith(STALE_READ_PREFIX)
+    assert contents[1].startswith(STALE_READ_PREFIX)
+    assert not contents[2].startswith(STALE_READ_PREFIX)
+
+class _RequestError(Exception):
+    def __init__(self, message, code=None):
+        super().__init__(message)
+        self.code = code
+
+def test_only_context_overflows_count_as_overflow():
+    assert is_context_overflow(_RequestError("Error code: 400", code="context_length_exceeded"))
+    assert is_context_overflow(_RequestError("This model's maximum context length is 128000 tokens"))
+    assert not is_context_overflow(_RequestError("Invalid schema for function 'search'", code="invalid_request_error"))
@@ -2,17 +2,19 @@
 # requires-python = ">=3.10"
 # dependencies = [
 #     "requests>=2,<3",
-#     "mcp>=1.2.0,<2",
+#     "mcp>=1.9.0,<2",
+#     "python-dotenv",
 # ]
 # ///
 
+import os
+import argparse
+import tempfile
 from contextlib import AsyncExitStack, asynccontextmanager
 
-import uvicorn
-from starlette.applications import Starlette
-from starlette.routing import Mount
-
-from shttp_modules.filesystem import mcp as filesystem_mcp
+# Imports of the app (mcp, starlette, the tool modules) are deferred to create_app, which
+# only runs in the process that serves requests; the reloader and the production
+# supervisor never import them
 
 def combine_lifespans(*lifespans):
     @asynccontextmanager
@@ -25,20 +27,90 @@ def combine_lifespans(*lifespans):
     return combined_lifespan
 
 
-main_app = Starlette(
-    routes=[
-        Mount("/filesystem/", app=filesystem_mcp.streamable_http_app()),
-    ],
-    lifespan=combine_lifespans(
-        lambda _: filesystem_mcp.session_manager.run(),
-    ),
-)
+def create_app():
+    from starlette.applications import Starlette
+    from starlette.middleware import Middleware
+    from starlette.routing import Mount, Route
+
+    from shttp_modules import metrics
+    from shttp_modules import filesystem
+
+    @asynccontextmanager
+    async def prewarm(_):
+        # Set by --prewarm: start the tool pools before the first request instead of during it
+        if os.getenv("TOOLKAMI_PREWARM"):
+            filesystem.prewarm()
+        yield
+
+    return Starlette(
+        routes=[
+            Route("/metrics", metrics.metrics_endpoint),
+            Mount("/filesystem/", app=filesystem.mcp.streamable_http_app()),
+        ],
+        middleware=[Middleware(metrics.MetricsMiddleware)],
+        lifespan=combine_lifespans(
+            prewarm,
+            lambda _: filesystem.mcp.session_manager.run(),
+        ),
+    )
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="ToolKami MCP servers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8002)
+    parser.add_argument("--production", action="store_true", help="Run multiple workers without auto-reload")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes in production mode")
+    parser.add_argument("--cpu-workers", type=int, default=None, help="Processes per worker for CPU-heavy tool work in production mode (sets FILESYSTEM_CPU_WORKERS; default: cores / workers)")
+    parser.add_argument("--backlog", type=int, default=2048, help="Listen backlog in production mode")
+    parser.add_argument("--keep-alive", type=int, default=30, help="Seconds to keep idle HTTP connections open in production mode")
+    parser.add_argument("--prewarm", action="store_true", help="Start the tool thread/process pools before serving; without --production, also serve from this one resident process without auto-reload")
+    args = parser.parse_args()
+    if args.cpu_workers is not None and not args.production:
+        parser.error("--cpu-workers only applies with --production")
+    return args
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "__main__:main_app",
-        host="127.0.0.1",
-        port=8002,
-        reload=True,
-        reload_dirs=["."]
-    )
\ No newline at end of file
+    from dotenv import load_dotenv
+
+    # Settings in servers/.env apply unless already set in the environment; workers inherit them
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".env"))
+    args = parse_args()
+
+    import uvicorn
+
+    if args.prewarm:
+        os.environ["TOOLKAMI_PREWARM"] = "1"
+
+    if args.production:
+        # Read by each worker when it imports the filesystem module; by default the
+        # workers' CPU pools together get one process per core
+        if args.cpu_workers is not None:
+            os.environ["FILESYSTEM_CPU_WORKERS"] = str(args.cpu_workers)
+        else:
+            os.environ.setdefault("FILESYSTEM_CPU_WORKERS", str(max((os.cpu_count() or 1) // args.workers, 1)))
+        # Workers publish metrics snapshots here so /metrics on any worker covers all of them
+        os.environ.setdefault("TOOLKAMI_METRICS_DIR", tempfile.mkdtemp(prefix="toolkami-metrics-"))
+        # The app is stateless_http, so any worker can serve any request
+        uvicorn.run(
+            "__main__:create_app",
+            factory=True,
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            reload=False,
+            backlog=args.backlog,
+            timeout_keep_alive=args.keep_alive,
+            access_log=False,
+        )
+    elif args.prewarm:
+        # The app is built here, before the socket is bound, and served by this same interpreter
+        uvicorn.run(create_app(), host=args.host, port=args.port, access_log=False)
+    else:
+        uvicorn.run(
+            "__main__:create_app",
+            factory=True,
+            host=args.host,
+            port=args.port,
+            reload=True,
+            reload_dirs=["."]
+        )
@@ -0,0 +1,192 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = [
+#     "mcp>=1.9.0,<2",
+#     "httpx",
+# ]
+# ///
+"""Cold-start time of the server and client, with an import-time report and saved baselines.
+
+Server cases start `__main__.py` in each mode and time the first answered
+tools/list. The client case starts `clients/openai_client.py` against a
+pre-warmed server with stdin closed, so it exits at its first prompt; the time
+to exit is the time to the first prompt plus a short cleanup. Each case reports
+the median of --runs starts. Exits with status 1 if a case is slower than the
+baseline by more than --threshold.
+
+    uv run --script benchmarks/cold_start.py                   # compare with the baseline
+    uv run --script benchmarks/cold_start.py --save-baseline   # record a new baseline
+    uv run --script benchmarks/cold_start.py --imports         # only show what the imports cost
+
+Baselines are machine-specific; record one on the machine that runs the comparison.
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+from mcp_http import SERVERS_DIR, free_port, wait_until_ready  # noqa: E402
+
+CLIENTS_DIR = SERVERS_DIR.parent / "clients"
+BASELINE_FILE = pathlib.Path(__file__).resolve().parent / "baselines" / "cold_start.json"
+
+SERVER_MODES = {
+    "server_dev": [],
+    "server_production": ["--production", "--workers", "1"],
+    "server_prewarm": ["--prewarm"],
+}
+# (label, working directory, code doing the imports of a start up to serving or prompting)
+IMPORT_TARGETS = [
+    ("server", SERVERS_DIR, "\n".join([
+        "import importlib.util, uvicorn",
+        "spec = importlib.util.spec_from_file_location('server_main', '__main__.py')",
+        "server_main = importlib.util.module_from_spec(spec)",
+        "spec.loader.exec_module(server_main)",
+        "server_main.create_app()",
+    ])),
+    ("client", CLIENTS_DIR, "import openai_client, prompt_toolkit"),
+]
+
+
+def import_report(directory: pathlib.Path, code: str, top: int) -> Tuple[float, List[Tuple[float, str]]]:
+    """Total import seconds and the slowest top-level imports, from `python -X importtime`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=directory,
+        env={**os.environ, "PYTHONPATH": str(directory)},
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Imports failed:\n{result.stderr[-2000:]}")
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # Nested imports are indented further; only the top-level ones add up to the total
+        if not name.startswith("  "):
+            entries.append((int(cumulative) / 1e6, name.strip()))
+    total = sum(seconds for seconds, _ in entries)
+    return total, sorted(entries, reverse=True)[:top]
+
+
+def time_server_start(extra_args: List[str], timeout: float) -> float:
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "__main__.py", "--port", str(port), *extra_args],
+        cwd=SERVERS_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(f"http://127.0.0.1:{port}/filesystem/mcp/", timeout, process)
+        return time.perf_counter() - start
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def time_client_start(url: str, timeout: float) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "openai_client.py", url],
+        cwd=CLIENTS_DIR,
+        env={**os.environ, "PYTHONPATH": str(CLIENTS_DIR)},
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        timeout=timeout,
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+def run_cases(runs: int, timeout: float, name_filter: str) -> Dict[str, float]:
+    results: Dict[str, float] = {}
+    for name, extra_args in SERVER_MODES.items():
+        if name_filter in name:
+            results[name] = statistics.median(time_server_start(extra_args, timeout) for _ in range(runs))
+
+    if name_filter in "client_first_prompt":
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, "__main__.py", "--prewarm", "--port", str(port)],
+            cwd=SERVERS_DIR,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        url = f"http://127.0.0.1:{port}/filesystem/mcp/"
+        try:
+            wait_until_ready(url, timeout, server)
+            results["client_first_prompt"] = statistics.median(time_client_start(url, timeout) for _ in range(runs))
+        finally:
+            server.terminate()
+            server.wait(timeout=15)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--imports", action="store_true", help="Only print the import-time report")
+    parser.add_argument("--top", type=int, default=8, help="Slowest imports listed per target")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Write the results to {BASELINE_FILE.name}")
+    parser.add_argument("--baseline", type=pathlib.Path, default=BASELINE_FILE)
+    parser.add_argument("--threshold", type=float, default=1.3, help="Slowdown ratio reported as a regression")
+    parser.add_argument("--runs", type=int, default=5, help="Starts per case; the median is reported")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for one start")
+    parser.add_argument("--filter", default="", help="Only run cases whose name contains this")
+    args = parser.parse_args()
+
+    for label, directory, code in IMPORT_TARGETS:
+        total, slowest = import_report(directory, code, args.top)
+        print(f"{label} imports: {total * 1e3:.0f} ms")
+        for seconds, name in slowest:
+            print(f"  {seconds * 1e3:>8.1f} ms  {name}")
+    if args.imports:
+        return
+
+    baseline: Dict[str, float] = {}
+    if args.baseline.exists() and not args.save_baseline:
+        baseline = json.loads(args.baseline.read_text())["results"]
+
+    results = run_cases(args.runs, args.timeout, args.filter)
+    regressions = []
+    for name, seconds in results.items():
+        line = f"{name:<24}{seconds * 1e3:>10.0f} ms"
+        if name in baseline:
+            ratio = seconds / baseline[name]
+            line += f"   baseline {baseline[name] * 1e3:>8.0f} ms   {ratio:5.2f}x"
+            if ratio > args.threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps({
+            "machine": f"{platform.machine()} {platform.processor() or platform.system()}",
+            "python": platform.python_version(),
+            "results": results,
+        }, indent=2) + "\n")
+        print(f"Saved baseline to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} case(s) slower than baseline by more than {args.threshold}x: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = [
+#     "mcp>=1.9.0,<2",
+# ]
+# ///
+"""Microbenchmarks of the diff_fenced_edit_file parser and applier, with saved baselines.
+
+Times _parse_edit_blocks, _find_occurrences and _plan_file_edits in-process on
+fixed synthetic inputs. The inputs include SEARCH texts that only match when
+whitespace is ignored, and SEARCH texts that do not match at all. Each case is
+compared with baselines/edit_micro.json.
+Exits with status 1 if any case is slower than the baseline by more than
+--threshold, so it can gate changes to these hot paths.
+
+    uv run --script benchmarks/edit_micro.py                  # compare with the baseline
+    uv run --script benchmarks/edit_micro.py --save-baseline  # record a new baseline
+
+Baselines are machine-specific; record one on the machine that runs the comparison.
+"""
+
+import argparse
+import json
+import pathlib
+import platform
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from shttp_modules import filesystem  # noqa: E402
+
+BASELINE_FILE = pathlib.Path(__file__).resolve().parent / "baselines" / "edit_micro.json"
+
+
+def source_file(lines: int) -> str:
+    return "".join(f"def handler_{i}(request):\n    return respond(request, {i})\n\n" for i in range(lines // 3))
+
+
+def diff_text(path: str, blocks: int, lines: int) -> str:
+    step = max(lines // 3 // blocks, 1)
+    return "".join(
+        f"```diff\n{path}\n<<<<<<< SEARCH\n    return respond(request, {i})\n"
+        f"=======\n    return respond(request, {-i})\n>>>>>>> REPLACE\n```\n"
+        for i in range(0, lines // 3, step)[:blocks]
+    )
+
+
+def misindented_diff_text(path: str, blocks: int, lines: int) -> str:
+    """Blocks whose SEARCH text is indented differently from the file, so exact matching misses."""
+    step = max(lines // 3 // blocks, 1)
+    return "".join(
+        f"```diff\n{path}\n<<<<<<< SEARCH\ndef handler_{i}(request):\n  return respond(request, {i})\n"
+        f"=======\ndef handler_{i}(request):\n  return respond(request, {-i})\n>>>>>>> REPLACE\n```\n"
+        for i in range(0, lines // 3, step)[:blocks]
+    )
+
+
+def missing_diff_text(path: str, blocks: int, lines: int) -> str:
+    """Blocks whose SEARCH text is not in the file, so near misses are reported."""
+    step = max(lines // 3 // blocks, 1)
+    return "".join(
+        f"```diff\n{path}\n<<<<<<< SEARCH\ndef handler_{i}(request):\n    return respond(request, {i}, retry=True)\n"
+        f"=======\ndef handler_{i}(request):\n    return respond(request, {-i})\n>>>>>>> REPLACE\n```\n"
+        for i in range(0, lines // 3, step)[:blocks]
+    )
+
+
+def cases() -> List[Tuple[str, Callable[[], object]]]:
+    small = source_file(300)
+    large = source_file(150_000)
+    small_diff = diff_text("/src/small.py", 5, 300)
+    large_diff = diff_text("/src/large.py", 200, 150_000)
+    small_blocks = filesystem._parse_edit_blocks(small_diff)
+    large_blocks = filesystem._parse_edit_blocks(large_diff)
+    large_patterns = [block["search"] for block in large_blocks]
+    misindented_blocks = filesystem._parse_edit_blocks(misindented_diff_text("/src/large.py", 200, 150_000))
+    missing_blocks = filesystem._parse_edit_blocks(missing_diff_text("/src/large.py", 200, 150_000))
+    return [
+        ("parse_5_blocks", lambda: filesystem._parse_edit_blocks(small_diff)),
+        ("parse_200_blocks", lambda: filesystem._parse_edit_blocks(large_diff)),
+        ("find_200_patterns_3mb", lambda: filesystem._find_occurrences(large, large_patterns)),
+        ("plan_5_blocks_6kb", lambda: filesystem._plan_file_edits(small, small_blocks)),
+        ("plan_200_blocks_3mb", lambda: filesystem._plan_file_edits(large, large_blocks)),
+        ("plan_200_reindent_3mb", lambda: filesystem._plan_file_edits(large, misindented_blocks)),
+        ("plan_200_missing_3mb", lambda: filesystem._plan_file_edits(large, missing_blocks)),
+    ]
+
+
+def measure(func: Callable[[], object], min_time: float, repeats: int) -> float:
+    """Best-of-repeats seconds per call, each repeat running for at least min_time."""
+    func()
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        if time.perf_counter() - start >= min_time:
+            break
+        calls *= 2
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        best = min(best, (time.perf_counter() - start) / calls)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--save-baseline", action="store_true", help=f"Write the results to {BASELINE_FILE.name}")
+    parser.add_argument("--baseline", type=pathlib.Path, default=BASELINE_FILE)
+    parser.add_argument("--threshold", type=float, default=1.3, help="Slowdown ratio reported as a regression")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Seconds per timing repeat")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--filter", default="", help="Only run cases whose name contains this")
+    args = parser.parse_args()
+
+    baseline: Dict[str, float] = {}
+    if args.baseline.exists() and not args.save_baseline:
+        baseline = json.loads(args.baseline.read_text())["results"]
+
+    results: Dict[str, float] = {}
+    regressions = []
+    for name, func in cases():
+        if args.filter not in name:
+            continue
+        results[name] = measure(func, args.min_time, args.repeats)
+        line = f"{name:<24}{results[name] * 1e6:>12.1f} us"
+        if name in baseline:
+            ratio = results[name] / baseline[name]
+            line += f"   baseline {baseline[name] * 1e6:>10.1f} us   {ratio:5.2f}x"
+            if ratio > args.threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps({
+            "machine": f"{platform.machine()} {platform.processor() or platform.system()}",
+            "python": platform.python_version(),
+            "results": results,
+        }, indent=2) + "\n")
+        print(f"Saved baseline to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} case(s) slower than baseline by more than {args.threshold}x: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
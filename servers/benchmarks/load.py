@@ -0,0 +1,161 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = [
+#     "mcp>=1.9.0,<2",
+#     "httpx",
+# ]
+# ///
+"""Throughput and tail latency of read_file and diff_fenced_edit_file over HTTP.
+
+Starts `__main__.py --production` on a synthetic workspace and drives the
+/filesystem/mcp endpoint from a configurable number of concurrent clients,
+then reports requests/sec and p50/p95/p99 per tool, workspace and concurrency.
+
+    uv run --script benchmarks/load.py --workspace small huge deep --concurrency 1 16 64
+    uv run --script benchmarks/load.py --json results.json   # machine-readable results
+"""
+
+import argparse
+import asyncio
+import json
+import pathlib
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+import workspaces  # noqa: E402
+from mcp_http import ToolClient, percentiles, running_server  # noqa: E402
+
+READ_RANGE_LINES = 200
+
+
+class EditSlots:
+    """Slots owned by one client, so its SEARCH texts never race with other clients."""
+
+    def __init__(self, slots, values: Dict[int, int]):
+        self.slots = list(slots)
+        # Current value of every slot in the workspace, shared by all runs against it
+        self.values = values
+        self.next = 0
+
+    def diff_text(self) -> str:
+        """Edit for the next slot; call applied() once the server has made it."""
+        i = self.next % len(self.slots)
+        path, slot = self.slots[i]
+        old, new = self.values[slot], self.values[slot] + 1
+        return f"```diff\n{path}\n<<<<<<< SEARCH\nslot_{slot} = {old}\n=======\nslot_{slot} = {new}\n>>>>>>> REPLACE\n```\n"
+
+    def applied(self) -> None:
+        self.values[self.slots[self.next % len(self.slots)][1]] += 1
+        self.next += 1
+
+
+def read_arguments(workspace: workspaces.Workspace, rng: random.Random) -> Dict:
+    path = rng.choice(workspace.files)
+    lines = workspace.lines[path]
+    if lines <= READ_RANGE_LINES * 4:
+        return {"path": str(path)}
+    # Large files are read a window at a time, as an agent paging through them would
+    return {"path": str(path), "offset": rng.randrange(lines - READ_RANGE_LINES), "limit": READ_RANGE_LINES}
+
+
+def edit_succeeded(result: Dict) -> bool:
+    """Read `success` from a tools/call result, structured or as JSON text content."""
+    structured = result.get("structuredContent")
+    if structured is None:
+        try:
+            structured = json.loads(result["content"][0]["text"])
+        except (KeyError, IndexError, ValueError):
+            return False
+    # FastMCP wraps non-model return values as {"result": ...}
+    structured = structured.get("result", structured)
+    return bool(structured.get("success"))
+
+
+async def drive(url: str, tool: str, workspace: workspaces.Workspace, slot_values: Dict[int, int], concurrency: int, duration: float, seed: int) -> Dict:
+    if tool == "diff_fenced_edit_file" and concurrency > len(workspace.slots):
+        raise ValueError(f"Concurrency {concurrency} exceeds the {len(workspace.slots)} edit slots of the workspace")
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120.0, follow_redirects=True) as http:
+        client = ToolClient(url, http)
+        latencies: List[float] = []
+        errors = 0
+        deadline = time.perf_counter() + duration
+
+        async def worker(w: int) -> None:
+            nonlocal errors
+            rng = random.Random(seed + w)
+            slots = EditSlots(workspace.slots[w::concurrency], slot_values)
+            while time.perf_counter() < deadline:
+                if tool == "read_file":
+                    arguments = read_arguments(workspace, rng)
+                else:
+                    arguments = {"diff_text": slots.diff_text()}
+                start = time.perf_counter()
+                try:
+                    result = await client.call_tool(tool, arguments)
+                    if tool == "diff_fenced_edit_file":
+                        if not edit_succeeded(result):
+                            raise RuntimeError(result)
+                        slots.applied()
+                except Exception:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(w) for w in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return {"requests": len(latencies), "errors": errors, "throughput": len(latencies) / elapsed, **percentiles(latencies)}
+
+
+async def warm_up(url: str, workspace: workspaces.Workspace) -> None:
+    """Touch every file once so the first measured calls do not pay for cold caches."""
+    async with httpx.AsyncClient(timeout=120.0, follow_redirects=True) as http:
+        client = ToolClient(url, http)
+        rng = random.Random(0)
+        for _ in range(min(len(workspace.files), 200)):
+            await client.call_tool("read_file", read_arguments(workspace, rng))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workspace", nargs="+", default=["small", "huge", "deep"], choices=sorted(workspaces.WORKSPACES))
+    parser.add_argument("--tool", nargs="+", default=["read_file", "diff_fenced_edit_file"], choices=["read_file", "diff_fenced_edit_file"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to measure each combination")
+    parser.add_argument("--workers", type=int, default=1, help="Server worker processes")
+    parser.add_argument("--scale", type=float, default=1.0, help="Scales workspace file counts and sizes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=pathlib.Path, help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'workspace':<10}{'tool':<24}{'conc':>5}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for kind in args.workspace:
+        with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory() as index_dir:
+            workspace = workspaces.build(kind, pathlib.Path(tmp), args.scale)
+            slot_values = {slot: 0 for _, slot in workspace.slots}
+            with running_server(args.workers, env={"FILESYSTEM_INDEX_DIR": index_dir}) as url:
+                asyncio.run(warm_up(url, workspace))
+                for tool in args.tool:
+                    for concurrency in args.concurrency:
+                        stats = asyncio.run(drive(url, tool, workspace, slot_values, concurrency, args.duration, args.seed))
+                        results.append({"workspace": kind, "tool": tool, "concurrency": concurrency, **stats})
+                        print(
+                            f"{kind:<10}{tool:<24}{concurrency:>5}{stats['throughput']:>10.1f}"
+                            f"{stats['p50']:>9.2f}{stats['p95']:>9.2f}{stats['p99']:>9.2f}{stats['errors']:>8}"
+                        )
+
+    if args.json:
+        args.json.write_text(json.dumps({"workers": args.workers, "scale": args.scale, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Run the MCP server locally and call its tools over streamable HTTP.
+
+Shared by the benchmarks in this directory. Requests are plain JSON-RPC POSTs,
+which the stateless filesystem app accepts without an initialize handshake,
+so the client side adds as little overhead as possible to the measurements.
+"""
+
+import json
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+SERVERS_DIR = pathlib.Path(__file__).resolve().parents[1]
+MCP_HEADERS = {"Accept": "application/json, text/event-stream", "Content-Type": "application/json"}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def running_server(workers: int = 1, cpu_workers: Optional[int] = None, extra_args: Optional[List[str]] = None,
+                   env: Optional[Dict[str, str]] = None, timeout: float = 60.0) -> Iterator[str]:
+    """Start `__main__.py --production` on a free port and yield the filesystem MCP URL."""
+    port = free_port()
+    command = [sys.executable, "__main__.py", "--production", "--port", str(port), "--workers", str(workers)]
+    if cpu_workers is not None:
+        command += ["--cpu-workers", str(cpu_workers)]
+    command += extra_args or []
+    process = subprocess.Popen(
+        command,
+        cwd=SERVERS_DIR,
+        env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}/filesystem/mcp/"
+    try:
+        wait_until_ready(url, timeout, process)
+        # Measured requests go straight to the endpoint, not through a redirect each
+        yield resolve_endpoint(url)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def wait_until_ready(url: str, timeout: float, process: Optional[subprocess.Popen] = None) -> float:
+    """Poll tools/list until the server answers; returns the seconds it took."""
+    start = time.perf_counter()
+    deadline = start + timeout
+    with httpx.Client(timeout=2.0, follow_redirects=True) as client:
+        while time.perf_counter() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            try:
+                response = client.post(url, headers=MCP_HEADERS, json=rpc("tools/list"))
+                if response.status_code == 200:
+                    return time.perf_counter() - start
+            except httpx.TransportError:
+                pass
+            time.sleep(0.05)
+    raise TimeoutError(f"Server at {url} did not become ready within {timeout}s")
+
+
+def resolve_endpoint(url: str) -> str:
+    """The URL a (ready) server finally answers tools/list on, after following redirects."""
+    with httpx.Client(timeout=10.0, follow_redirects=True) as client:
+        response = client.post(url, headers=MCP_HEADERS, json=rpc("tools/list"))
+        response.raise_for_status()
+        return str(response.url)
+
+
+def rpc(method: str, params: Optional[Dict[str, Any]] = None, request_id: int = 1) -> Dict[str, Any]:
+    message: Dict[str, Any] = {"jsonrpc": "2.0", "id": request_id, "method": method}
+    if params is not None:
+        message["params"] = params
+    return message
+
+
+def parse_response(response: httpx.Response) -> Dict[str, Any]:
+    """Decode a JSON or single-event SSE response into its JSON-RPC message."""
+    response.raise_for_status()
+    if response.headers.get("content-type", "").startswith("text/event-stream"):
+        for line in response.text.splitlines():
+            if line.startswith("data:"):
+                return json.loads(line[5:])
+        raise ValueError("No data event in SSE response")
+    return response.json()
+
+
+class ToolClient:
+    """Calls tools on one MCP endpoint over a shared keep-alive connection pool."""
+
+    def __init__(self, url: str, client: httpx.AsyncClient):
+        self.url = url
+        self.client = client
+        self._next_id = 0
+
+    async def call_tool(self, name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        self._next_id += 1
+        response = await self.client.post(
+            self.url,
+            headers=MCP_HEADERS,
+            json=rpc("tools/call", {"name": name, "arguments": arguments}, self._next_id),
+        )
+        message = parse_response(response)
+        if "error" in message:
+            raise RuntimeError(f"{name} failed: {message['error']}")
+        result = message["result"]
+        if result.get("isError"):
+            raise RuntimeError(f"{name} failed: {result.get('content')}")
+        return result
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 and max of latency samples, in milliseconds."""
+    if not samples:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+
+    def at(fraction: float) -> float:
+        return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] * 1e3
+
+    return {"p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": ordered[-1] * 1e3}
@@ -0,0 +1,123 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = [
+#     "mcp>=1.9.0,<2",
+# ]
+# ///
+"""Latency of small read_file calls while large diff_fenced_edit_file calls run.
+
+Runs the filesystem tools in-process on one event loop. With --inline the
+blocking work is executed directly on the loop, which reproduces the behaviour
+before it was moved to the I/O pool and serves as the comparison baseline.
+
+    uv run --script benchmarks/read_latency.py --readers 8 --editors 2
+"""
+
+import argparse
+import asyncio
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from shttp_modules import filesystem  # noqa: E402
+
+
+def make_workspace(root: pathlib.Path, small_files: int, big_lines: int) -> pathlib.Path:
+    for i in range(small_files):
+        (root / f"small_{i}.py").write_text(f"def f{i}():\n    return {i}\n" * 20)
+    big = root / "big.py"
+    big.write_text("".join(f"value_{i} = {i}\n" for i in range(big_lines)))
+    return big
+
+
+def edit_text(big: pathlib.Path, blocks: int, big_lines: int, generation: int) -> str:
+    step = max(big_lines // blocks, 1)
+    return "".join(
+        f"```diff\n{big}\n<<<<<<< SEARCH\nvalue_{i} = {i if generation % 2 == 0 else -i}\n"
+        f"=======\nvalue_{i} = {-i if generation % 2 == 0 else i}\n>>>>>>> REPLACE\n```\n"
+        for i in range(1, big_lines, step)
+    )
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+async def check_large_read(big: pathlib.Path) -> None:
+    """A plain read of a file over READ_MAX_BYTES must return its head/tail preview."""
+    preview = await filesystem.read_file(str(big))
+    if not (isinstance(preview, dict) and preview.get("truncated") and preview.get("head") and preview.get("tail")):
+        raise RuntimeError(f"read_file of a {big.stat().st_size}-byte file did not return a preview: {str(preview)[:200]}")
+
+
+async def run(args) -> None:
+    if args.inline:
+        async def run_inline(func, *a, **k):
+            return func(*a, **k)
+        filesystem._run_blocking = run_inline
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = pathlib.Path(tmp)
+        big = make_workspace(root, args.small_files, args.big_lines)
+        small = [str(path) for path in root.glob("small_*.py")]
+        await check_large_read(big)
+        deadline = time.perf_counter() + args.duration
+        latencies = []
+        edits = 0
+
+        async def reader(worker: int) -> None:
+            # Reads are issued on a fixed schedule and timed from when they were due,
+            # so time spent waiting for a blocked event loop is counted
+            i = worker
+            due = time.perf_counter()
+            while due < deadline:
+                await asyncio.sleep(max(due - time.perf_counter(), 0))
+                await filesystem.read_file(small[i % len(small)])
+                latencies.append(time.perf_counter() - due)
+                i += args.readers
+                due += args.interval / 1e3
+
+        async def editor() -> None:
+            nonlocal edits
+            generation = 0
+            while time.perf_counter() < deadline:
+                text = edit_text(big, args.blocks, args.big_lines, generation)
+                await filesystem.diff_fenced_edit_file(text)
+                generation += 1
+                edits += 1
+
+        await asyncio.gather(
+            *(reader(worker) for worker in range(args.readers)),
+            *(editor() for _ in range(args.editors)),
+        )
+
+    mode = "inline" if args.inline else f"pool({filesystem.IO_WORKERS})"
+    print(f"mode={mode} reads={len(latencies)} edits={edits}")
+    print(
+        "read latency ms: "
+        f"p50={statistics.median(latencies) * 1e3:.2f} "
+        f"p99={percentile(latencies, 0.99) * 1e3:.2f} "
+        f"max={max(latencies) * 1e3:.2f}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds to run")
+    parser.add_argument("--readers", type=int, default=8, help="Concurrent small-file readers")
+    parser.add_argument("--interval", type=float, default=5.0, help="Milliseconds between reads per reader")
+    parser.add_argument("--editors", type=int, default=2, help="Concurrent large-file editors")
+    parser.add_argument("--small-files", type=int, default=200)
+    parser.add_argument("--big-lines", type=int, default=500_000)
+    parser.add_argument("--blocks", type=int, default=40, help="Edit blocks per diff_fenced_edit_file call")
+    parser.add_argument("--inline", action="store_true", help="Run blocking work on the event loop (baseline)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# /// script
+# requires-python = ">=3.10"
+# dependencies = [
+#     "mcp>=1.9.0,<2",
+#     "httpx",
+# ]
+# ///
+"""Requests/sec of the production server as the worker count grows.
+
+Starts `__main__.py --production` once per worker count, then drives tool calls
+over streamable HTTP from a fixed number of concurrent clients.
+
+    uv run --script benchmarks/server_scaling.py --workers 1 2 4 8 --tool search
+"""
+
+import argparse
+import asyncio
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+import httpx
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+from mcp_http import ToolClient, percentiles, running_server  # noqa: E402
+
+
+def make_workspace(root: pathlib.Path, files: int) -> None:
+    for i in range(files):
+        package = root / f"pkg_{i % 50}"
+        package.mkdir(exist_ok=True)
+        body = "".join(f"def handler_{i}_{j}(request):\n    return respond(request, {j})\n\n" for j in range(200))
+        (package / f"module_{i}.py").write_text(body)
+
+
+def tool_arguments(tool: str, root: pathlib.Path, files: int, i: int):
+    if tool == "read_file":
+        return {"path": str(root / f"pkg_{i % files % 50}" / f"module_{i % files}.py")}
+    if tool == "search":
+        return {"query": rf"def handler_{i % files}_1\d+\(", "path": str(root), "regex": True, "max_results": 5}
+    if tool == "diff_fenced_edit_file":
+        # Each request flips one function in its own file back and forth
+        path = root / f"pkg_{i % files % 50}" / f"module_{i % files}.py"
+        old, new = ("respond(request, 7)", "respond(request, -7)") if (i // files) % 2 == 0 else ("respond(request, -7)", "respond(request, 7)")
+        return {"diff_text": f"```diff\n{path}\n<<<<<<< SEARCH\n{old}\n=======\n{new}\n>>>>>>> REPLACE\n```\n"}
+    raise ValueError(f"Unknown tool {tool}")
+
+
+async def drive(url: str, args, root: pathlib.Path):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60.0, follow_redirects=True) as http:
+        tools = ToolClient(url, http)
+        counter = iter(range(10**9))
+        latencies = []
+        errors = 0
+        deadline = time.perf_counter() + args.duration
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                i = next(counter)
+                start = time.perf_counter()
+                try:
+                    await tools.call_tool(args.tool, tool_arguments(args.tool, root, args.files, i))
+                except Exception:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+
+        # Warm caches and the search index before measuring
+        await tools.call_tool(args.tool, tool_arguments(args.tool, root, args.files, 0))
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, percentiles(latencies), errors
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument("--cpu-workers", type=int, default=None, help="Forwarded to the server (FILESYSTEM_CPU_WORKERS)")
+    parser.add_argument("--tool", default="read_file", choices=["read_file", "search", "diff_fenced_edit_file"])
+    parser.add_argument("--concurrency", type=int, default=64, help="Concurrent client requests")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to measure per worker count")
+    parser.add_argument("--files", type=int, default=500, help="Files in the synthetic workspace")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory() as index_dir:
+        root = pathlib.Path(tmp)
+        make_workspace(root, args.files)
+        print(f"tool={args.tool} concurrency={args.concurrency} cores={os.cpu_count()}")
+        baseline = None
+        for workers in sorted(set(args.workers)):
+            with running_server(workers, args.cpu_workers, env={"FILESYSTEM_INDEX_DIR": index_dir}) as url:
+                throughput, latency, errors = asyncio.run(drive(url, args, root))
+            baseline = baseline or throughput
+            print(
+                f"workers={workers:<3} req/s={throughput:9.1f} speedup={throughput / baseline:5.2f}x "
+                f"p50={latency['p50']:.1f}ms p99={latency['p99']:.1f}ms errors={errors}"
+            )
+
+
+if __name__ == "__main__":
+    main()
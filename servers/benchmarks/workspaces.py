@@ -0,0 +1,100 @@
+"""Synthetic workspaces for the benchmarks in this directory.
+
+Every generated file contains `slot_<n> = <value>` lines. Each slot is unique
+across the workspace, so concurrent benchmark clients can each own a set of
+slots and edit them with SEARCH texts that always match exactly once.
+"""
+
+import pathlib
+import random
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+FILLER_LINES = [
+    "def handler_{n}(request):",
+    "    payload = request.json()",
+    "    if not payload.get('id'):",
+    "        raise ValueError('missing id')",
+    "    return respond(payload, status={n})",
+    "",
+]
+
+@dataclass
+class Workspace:
+    root: pathlib.Path
+    files: List[pathlib.Path] = field(default_factory=list)
+    # (file, slot number); slot values start at 0
+    slots: List[Tuple[pathlib.Path, int]] = field(default_factory=list)
+    lines: Dict[pathlib.Path, int] = field(default_factory=dict)
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(path.stat().st_size for path in self.files)
+
+
+def _write_file(workspace: Workspace, path: pathlib.Path, target_bytes: int, slots: int) -> None:
+    """Write filler code of roughly target_bytes with `slots` slot lines spread evenly through it."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    chunk = "\n".join(FILLER_LINES) + "\n"
+    chunks = max(target_bytes // len(chunk), slots, 1)
+    every = max(chunks // max(slots, 1), 1)
+    written_slots = 0
+    line_count = 0
+    with open(path, "w") as f:
+        for i in range(chunks):
+            if written_slots < slots and i % every == 0:
+                slot = len(workspace.slots)
+                f.write(f"slot_{slot} = 0\n")
+                workspace.slots.append((path, slot))
+                written_slots += 1
+                line_count += 1
+            f.write(chunk.replace("{n}", str(i)))
+            line_count += len(FILLER_LINES)
+    workspace.files.append(path)
+    workspace.lines[path] = line_count
+
+
+def many_small(root: pathlib.Path, files: int = 2000, file_bytes: int = 2048) -> Workspace:
+    """Many small source files spread over a few dozen directories."""
+    workspace = Workspace(root)
+    for i in range(files):
+        _write_file(workspace, root / f"pkg_{i % 40}" / f"module_{i}.py", file_bytes, slots=1)
+    return workspace
+
+
+def few_huge(root: pathlib.Path, files: int = 4, file_bytes: int = 32 * 1024 * 1024, slots_per_file: int = 256) -> Workspace:
+    """A handful of very large files, each with many editable slots."""
+    workspace = Workspace(root)
+    for i in range(files):
+        _write_file(workspace, root / f"generated_{i}.py", file_bytes, slots=slots_per_file)
+    return workspace
+
+
+def deep_tree(root: pathlib.Path, depth: int = 12, fanout: int = 2, file_bytes: int = 4096, seed: int = 0) -> Workspace:
+    """A deep, narrow directory tree with a few files at every level."""
+    workspace = Workspace(root)
+    rng = random.Random(seed)
+    level = [root]
+    for d in range(depth):
+        next_level = []
+        for directory in level:
+            for j in range(rng.randint(1, 3)):
+                _write_file(workspace, directory / f"level_{d}_{j}.py", file_bytes, slots=4)
+            next_level.extend(directory / f"dir_{k}" for k in range(fanout))
+        # Keep the tree deep rather than wide
+        level = rng.sample(next_level, min(len(next_level), 4))
+    return workspace
+
+
+WORKSPACES = {"small": many_small, "huge": few_huge, "deep": deep_tree}
+
+
+def build(kind: str, root: pathlib.Path, scale: float = 1.0) -> Workspace:
+    """Generate one of WORKSPACES under root; scale shrinks or grows file counts and sizes."""
+    if kind == "small":
+        return many_small(root, files=max(int(2000 * scale), 1))
+    if kind == "huge":
+        return few_huge(root, file_bytes=max(int(32 * 1024 * 1024 * scale), 1024))
+    if kind == "deep":
+        return deep_tree(root, depth=max(int(12 * scale), 2))
+    raise ValueError(f"Unknown workspace {kind!r}; expected one of {sorted(WORKSPACES)}")
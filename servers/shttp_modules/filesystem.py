@@ -1,22 +1,1195 @@
 # server.py
 from mcp.server.fastmcp import FastMCP
+from mcp.types import ToolAnnotations
 
+import os
 import re
+import mmap
 import uuid
+import glob
+import bisect
+import hashlib
 import shutil
 import pathlib
-from typing import Dict, Any, List, Optional
+import asyncio
+import datetime
+import tempfile
+import functools
+import threading
+import multiprocessing
+import contextvars
+from array import array
+from collections import Counter, OrderedDict, deque
+from itertools import accumulate, islice
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Any, List, Optional, Tuple, TypeVar, Union
+
+from . import metrics, trigram_index
 
 # Create an MCP server
 mcp = FastMCP("Filesystem", stateless_http=True)
 
-@mcp.tool()
-async def read_file(path: str) -> str:
-    """Read the contents of a file."""
-    return pathlib.Path(path).read_text()
+# Blocking disk I/O and scans run on this bounded pool instead of the event loop
+IO_WORKERS = int(os.getenv("FILESYSTEM_IO_WORKERS", "8"))
+_io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="filesystem-io")
+# Edits to the same file are serialized, across threads and server worker processes,
+# so concurrent calls cannot interleave read-modify-write cycles
+EDIT_LOCK_DIR = os.path.join(tempfile.gettempdir(), "toolkami-edit-locks")
+_edit_thread_locks: Dict[str, threading.Lock] = {}
+_edit_thread_locks_guard = threading.Lock()
+
+# CPU-bound work (edit matching, search scans) on large inputs runs in this many
+# processes so it neither holds the GIL nor blocks the I/O threads; 0 runs it inline
+CPU_WORKERS = int(os.getenv("FILESYSTEM_CPU_WORKERS", "0"))
+# Inputs smaller than this are cheaper to process inline than to pickle to a worker
+CPU_OFFLOAD_MIN_BYTES = 256 * 1024
+_cpu_executor: Optional[ProcessPoolExecutor] = None
+_cpu_executor_lock = threading.Lock()
+
+T = TypeVar("T")
+
+async def _run_blocking(func: Callable[..., T], *args, **kwargs) -> T:
+    """Run a blocking function on the I/O pool without stalling the event loop.
+
+    The caller's context is carried over so metrics are attributed to the calling tool.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_io_executor, functools.partial(context.run, func, *args, **kwargs))
+
+def _get_cpu_executor() -> Optional[ProcessPoolExecutor]:
+    """Create the CPU process pool on first use, so importing this module stays cheap."""
+    global _cpu_executor
+    if CPU_WORKERS <= 0:
+        return None
+    with _cpu_executor_lock:
+        if _cpu_executor is None:
+            # Forking a process that runs the event loop and I/O threads could copy held locks
+            # into the child; forkserver children start from a clean process with this module
+            # already imported
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__])
+            _cpu_executor = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=context)
+        return _cpu_executor
+
+def prewarm() -> None:
+    """Start every I/O thread and CPU worker process now rather than on first use.
+
+    Pools otherwise grow lazily, so the first large edit or search would pay
+    for spawning processes and importing this module in each of them.
+    """
+    barrier = threading.Barrier(IO_WORKERS + 1)
+    for _ in range(IO_WORKERS):
+        # Each task waits for the others, so every worker thread gets started
+        _io_executor.submit(barrier.wait)
+    barrier.wait()
+    executor = _get_cpu_executor()
+    if executor is not None:
+        for future in [executor.submit(_normalize_line, "") for _ in range(CPU_WORKERS)]:
+            future.result()
+
+def _run_cpu(func: Callable[..., T], *args, size: int) -> T:
+    """Run a pure, module-level function in the CPU pool when the input is large enough.
+
+    Called from I/O pool threads, which block on the result without holding the GIL.
+    """
+    executor = _get_cpu_executor() if size >= CPU_OFFLOAD_MIN_BYTES else None
+    if executor is None:
+        return func(*args)
+    return executor.submit(func, *args).result()
+
+@contextmanager
+def _edit_locks(file_paths: List[str]):
+    """Hold an exclusive lock per file, acquired in sorted order to avoid deadlocks.
+
+    Uses flock on a lock file per path, which excludes other threads and other
+    server processes alike; without fcntl it falls back to in-process locks.
+    """
+    paths = sorted({os.path.abspath(file_path) for file_path in file_paths})
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+
+    with ExitStack() as stack:
+        if fcntl is not None:
+            os.makedirs(EDIT_LOCK_DIR, exist_ok=True)
+        for path in paths:
+            if fcntl is None:
+                with _edit_thread_locks_guard:
+                    lock = _edit_thread_locks.setdefault(path, threading.Lock())
+                stack.enter_context(lock)
+                continue
+            digest = hashlib.sha1(path.encode("utf-8")).hexdigest()
+            lock_file = stack.enter_context(open(os.path.join(EDIT_LOCK_DIR, digest + ".lock"), "a"))
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            stack.callback(fcntl.flock, lock_file.fileno(), fcntl.LOCK_UN)
+        yield
+
+EDIT_BLOCK_PATTERN = re.compile(
+    r'```diff\n(.*?)\n<<<<<<< SEARCH\n(.*?)=======\n(.*?)>>>>>>> REPLACE\n```',
+    re.DOTALL,
+)
+
+# Files larger than this are returned as a head/tail preview unless a range is requested
+READ_MAX_BYTES = 256 * 1024
+READ_PREVIEW_BYTES = 8 * 1024
+# Files at least this large are read through mmap instead of being loaded whole
+MMAP_THRESHOLD = 1024 * 1024
+LINE_INDEX_CHUNK = 1024 * 1024
+LINE_INDEX_CACHE_SIZE = 32
+# Memory budget for file contents cached between tool calls
+CACHE_BYTES = int(os.getenv("FILESYSTEM_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+class _ContentCache:
+    """LRU cache of file bytes within a memory budget, validated by stat.
+
+    Entries are keyed by absolute path and only returned while the file's
+    inode, mtime and size still match the ones recorded with the content.
+    """
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int, int], bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _version(stat: os.stat_result) -> Tuple[int, int, int]:
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def get(self, path: str, stat: os.stat_result) -> Optional[bytes]:
+        path = os.path.abspath(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == self._version(stat):
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, path: str, stat: os.stat_result, data: bytes) -> None:
+        path = os.path.abspath(path)
+        with self._lock:
+            old = self._entries.pop(path, None)
+            if old is not None:
+                self.used -= len(old[1])
+            if len(data) > self.budget:
+                return
+            self._entries[path] = (self._version(stat), data)
+            self.used += len(data)
+            while self.used > self.budget:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.used -= len(evicted)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.used,
+                "budget": self.budget,
+            }
+
+_content_cache = _ContentCache(CACHE_BYTES)
+
+def _read_bytes(path: str, stat: Optional[os.stat_result] = None, populate: bool = True) -> Tuple[bytes, os.stat_result]:
+    """Return a file's bytes and stat, from the content cache when still valid.
+
+    populate=False reads misses without caching them, for bulk scans that should
+    not evict the files an agent is working on.
+    """
+    stat = stat or os.stat(path)
+    data = _content_cache.get(path, stat)
+    if data is not None:
+        return data, stat
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        data = f.read()
+    metrics.record_bytes("read", len(data))
+    if populate:
+        _content_cache.put(path, stat, data)
+    return data, stat
+
+def _decode_text(data: bytes) -> str:
+    """Decode file bytes for editing, with universal newlines like Path.read_text."""
+    return data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+class _LineIndex:
+    """Byte offsets of line starts in one version of a file, extended lazily."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.starts = array("Q", [0])
+        self.scanned = 0
+        self.complete = False
+
+    def ensure_line(self, data, size: int, line: int) -> None:
+        """Scan forward until the start of `line` is known or the file ends."""
+        while not self.complete and len(self.starts) <= line:
+            self._scan_chunk(data, size)
+
+    def ensure_position(self, data, size: int, position: int) -> None:
+        """Scan forward until every line start up to byte `position` is known."""
+        while not self.complete and self.scanned <= position:
+            self._scan_chunk(data, size)
+
+    def _scan_chunk(self, data, size: int) -> None:
+        end = min(self.scanned + LINE_INDEX_CHUNK, size)
+        parts = data[self.scanned:end].split(b"\n")
+        # Line lengths plus their newline, accumulated into absolute offsets
+        self.starts.extend(islice(accumulate(map((1).__add__, map(len, parts[:-1])), initial=self.scanned), 1, None))
+        self.scanned = end
+        self.complete = end >= size
+
+    def line_count(self, size: int) -> int:
+        return len(self.starts) - (1 if self.starts[-1] == size else 0)
+
+_line_indexes: "OrderedDict[Tuple[str, int, int, int], _LineIndex]" = OrderedDict()
+_line_indexes_lock = threading.Lock()
+
+def _line_index(path: str, stat: os.stat_result) -> _LineIndex:
+    """Return the cached line index for this version of the file, creating it if needed."""
+    key = (os.path.realpath(path), stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _line_indexes_lock:
+        index = _line_indexes.get(key)
+        if index is None:
+            index = _line_indexes[key] = _LineIndex()
+            while len(_line_indexes) > LINE_INDEX_CACHE_SIZE:
+                _line_indexes.popitem(last=False)
+        else:
+            _line_indexes.move_to_end(key)
+    return index
+
+def _read_range(path: str, offset: Optional[int], limit: Optional[int], unit: str) -> Union[str, Dict[str, Any]]:
+    """Read a file, a byte range or a line range of it.
+
+    Files below MMAP_THRESHOLD come from the content cache; larger files are
+    mmapped so only the requested pages are touched.
+    """
+    if unit not in ("lines", "bytes"):
+        raise ValueError(f"unit must be 'lines' or 'bytes', got {unit!r}")
+    if (offset is not None and offset < 0) or (limit is not None and limit < 0):
+        raise ValueError("offset and limit must be non-negative")
+
+    stat = os.stat(path)
+    if stat.st_size < MMAP_THRESHOLD:
+        data, stat = _read_bytes(path, stat)
+        return _slice_content(path, stat, data, offset, limit, unit)
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        result = _slice_content(path, os.fstat(f.fileno()), data, offset, limit, unit)
+    # Only the returned pages (plus line index scans, not counted) are read from the mapping
+    metrics.record_bytes("read", _returned_chars(result))
+    return result
+
+def _returned_chars(result: Union[str, Dict[str, Any]]) -> int:
+    """Size of the text a read returns: the content, or the head and tail of a preview."""
+    if isinstance(result, str):
+        return len(result)
+    return sum(len(result.get(field, "")) for field in ("content", "head", "tail"))
+
+def _slice_content(path: str, stat: os.stat_result, data, offset: Optional[int], limit: Optional[int], unit: str) -> Union[str, Dict[str, Any]]:
+    """Cut the requested range out of a file's bytes (or mmap) and describe it."""
+    size = len(data)
+    if offset is None and limit is None:
+        if size <= READ_MAX_BYTES:
+            return data[:].decode("utf-8", errors="replace")
+        return {
+            "path": path,
+            "size": size,
+            "truncated": True,
+            "head": data[:READ_PREVIEW_BYTES].decode("utf-8", errors="replace"),
+            "tail": data[max(size - READ_PREVIEW_BYTES, READ_PREVIEW_BYTES):].decode("utf-8", errors="replace"),
+            "message": f"File is larger than {READ_MAX_BYTES} bytes; pass offset/limit to read a range.",
+        }
+
+    offset = offset or 0
+    result: Dict[str, Any] = {"path": path, "size": size, "unit": unit, "offset": offset}
+    if unit == "bytes":
+        start = min(offset, size)
+        end = size if limit is None else min(start + limit, size)
+        truncated = end - start > READ_MAX_BYTES
+        if truncated:
+            end = start + READ_MAX_BYTES
+        result.update(next_offset=end, eof=end >= size)
+    else:
+        index = _line_index(path, stat)
+        with index.lock:
+            last_line = None if limit is None else offset + limit
+            index.ensure_line(data, size, offset if last_line is None else last_line)
+            start = index.starts[offset] if offset < len(index.starts) else size
+            end = index.starts[last_line] if last_line is not None and last_line < len(index.starts) else size
+            next_line = last_line if end < size else None
+            truncated = end - start > READ_MAX_BYTES
+            if truncated:
+                # Stop at the last whole line that fits, or cut a single oversized line
+                cap = start + READ_MAX_BYTES
+                index.ensure_position(data, size, cap)
+                fit = bisect.bisect_right(index.starts, cap, lo=offset) - 1
+                if fit > offset:
+                    next_line, end = fit, index.starts[fit]
+                else:
+                    next_line, end = offset + 1, cap
+            result.update(next_offset=next_line, eof=end >= size)
+            if index.complete:
+                result["total_lines"] = index.line_count(size)
+
+    result.update(truncated=truncated, content=data[start:end].decode("utf-8", errors="replace"))
+    return result
+
+@mcp.resource("filesystem://cache/stats")
+def cache_stats() -> Dict[str, int]:
+    """Hit/miss counters and memory use of the file content cache."""
+    return _content_cache.stats()
+
+metrics.REGISTRY.register_collector(lambda: {
+    f"toolkami_content_cache_{name}": (f"File content cache {name}.", value)
+    for name, value in _content_cache.stats().items()
+})
+
+@mcp.tool(annotations=ToolAnnotations(readOnlyHint=True))
+@metrics.instrument_tool
+async def read_file(path: str, offset: Optional[int] = None, limit: Optional[int] = None, unit: str = "lines") -> Union[str, Dict[str, Any]]:
+    """Read the contents of a file.
+
+Without offset/limit the whole file is returned as text, or a head/tail preview
+with metadata if it is too large. With offset/limit (in `unit` of "lines" or
+"bytes", offset is 0-based) the requested range is returned with metadata and a
+`next_offset` to continue from.
+"""
+    return await _run_blocking(_read_range, path, offset, limit, unit)
+
+READ_MANY_MAX_BYTES = 200 * 1024
+# Largest max_bytes a caller may ask for; larger values are clamped to it
+READ_MANY_MAX_BYTES_LIMIT = 1024 * 1024
+READ_MANY_MAX_FILES = 200
+LINE_RANGE_PATTERN = re.compile(r'^(.*)#L(\d+)(?:-L?(\d+))?$')
+
+def _expand_read_requests(paths: List[str], max_files: int) -> List[Dict[str, Any]]:
+    """Expand globs and split off '#Lstart-end' line ranges (1-based, inclusive).
+
+    Expansion stops at max_files readable entries, so a broad `**` glob does
+    not walk the whole tree; entries past the cap are reported as errors.
+    """
+    requests: List[Dict[str, Any]] = []
+    seen = set()
+    readable = 0
+    for entry in paths:
+        if readable >= max_files:
+            requests.append({"path": entry, "status": "error", "message": f"More than {max_files} files requested"})
+            continue
+        match = LINE_RANGE_PATTERN.match(entry)
+        path, first, last = (match.group(1), int(match.group(2)), int(match.group(3) or match.group(2))) if match else (entry, None, None)
+        overflow = False
+        if glob.has_magic(path):
+            matches = (p for p in glob.iglob(path, recursive=True) if os.path.isfile(p))
+            expanded = sorted(islice(matches, max_files - readable + 1))
+            if not expanded:
+                requests.append({"path": path, "status": "error", "message": "No files match the glob"})
+            overflow = len(expanded) > max_files - readable
+        else:
+            expanded = [path]
+        for file_path in expanded:
+            key = (file_path, first, last)
+            if key in seen:
+                continue
+            if readable >= max_files:
+                break
+            seen.add(key)
+            requests.append({"path": file_path, "first_line": first, "last_line": last})
+            readable += 1
+        if overflow:
+            requests.append({"path": path, "status": "error", "message": f"The glob matches more than the {max_files} files allowed; the rest were skipped"})
+    return requests
+
+def _read_for_batch(request: Dict[str, Any], cap: int) -> Dict[str, Any]:
+    """Read one batch entry, never more than cap bytes, and record its full size."""
+    result = {"path": request["path"]}
+    try:
+        if request["first_line"] is not None:
+            first = max(request["first_line"], 1)
+            sliced = _read_range(request["path"], first - 1, max(request["last_line"] - first + 1, 0), "lines")
+            data = sliced["content"].encode("utf-8")
+            result.update(size=len(data), range=[first, request["last_line"]], complete=not sliced["truncated"])
+        else:
+            stat = os.stat(request["path"])
+            if stat.st_size <= cap:
+                data, stat = _read_bytes(request["path"], stat)
+            else:
+                with open(request["path"], "rb") as f:
+                    data = f.read(cap)
+                metrics.record_bytes("read", len(data))
+            result.update(size=stat.st_size, complete=len(data) >= stat.st_size)
+    except (OSError, ValueError) as e:
+        result.update(status="error", message=str(e))
+        return result
+    result["data"] = data[:cap]
+    return result
+
+def _fair_shares(sizes: List[int], budget: int) -> List[int]:
+    """Split a byte budget max-min fairly: small files get all they need, the rest share evenly."""
+    shares = [0] * len(sizes)
+    remaining = budget
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    for position, i in enumerate(order):
+        share = min(sizes[i], remaining // (len(order) - position))
+        shares[i] = share
+        remaining -= share
+    return shares
+
+@mcp.tool(annotations=ToolAnnotations(readOnlyHint=True))
+@metrics.instrument_tool
+async def read_many_files(paths: List[str], max_bytes: int = READ_MANY_MAX_BYTES) -> Dict[str, Any]:
+    """Read several files in one call, within one shared byte budget.
+
+Entries may be paths, globs (`src/**/*.py`) or line ranges (`src/app.py#L10-40`,
+1-based inclusive). Files are read in parallel. When the total exceeds
+`max_bytes` (roughly 4 bytes per token), the budget is split fairly: small
+files are returned whole and larger ones are truncated at a line boundary.
+Each entry reports its status: ok, truncated or error. `max_bytes` must be
+positive and is capped at 1 MiB; at most 200 files are read.
+"""
+    if max_bytes <= 0:
+        raise ValueError("max_bytes must be positive")
+    max_bytes = min(max_bytes, READ_MANY_MAX_BYTES_LIMIT)
+    # Glob expansion walks directories, so it runs on the I/O pool like the reads
+    requests = await _run_blocking(_expand_read_requests, paths, READ_MANY_MAX_FILES)
+    readable = [request for request in requests if "status" not in request]
+
+    reads = await asyncio.gather(*(_run_blocking(_read_for_batch, request, max_bytes) for request in readable))
+    results = iter(reads)
+    entries = [next(results) if "status" not in request else request for request in requests]
+
+    loaded = [entry for entry in entries if "data" in entry]
+    shares = _fair_shares([len(entry["data"]) for entry in loaded], max_bytes)
+    total = 0
+    for entry, share in zip(loaded, shares):
+        data = entry.pop("data")
+        truncated = not entry.pop("complete") or share < len(data)
+        if share < len(data):
+            cut = data.rfind(b"\n", 0, share) + 1
+            data = data[:cut or share]
+        entry.update(status="truncated" if truncated else "ok", content=data.decode("utf-8", errors="replace"))
+        total += len(data)
+
+    return {"files": entries, "total_bytes": total, "max_bytes": max_bytes}
+
+LIST_TREE_MAX_LINES = 400
+LIST_TREE_MAX_SCAN_ENTRIES = 200_000
+DIRECTORY_CACHE_SIZE = 20_000
+
+class _DirectoryCache:
+    """Directory listings cached by the directory's mtime.
+
+    A directory's mtime changes when entries are added, removed or renamed, so
+    only those directories are rescanned. File sizes and mtimes are refreshed
+    with the listing of their directory: edits made by these tools replace the
+    file and so refresh it, but a file rewritten in place by another program
+    keeps its listed size and mtime until its directory changes.
+    """
+
+    def __init__(self, max_directories: int):
+        self.max_directories = max_directories
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[int, List[Tuple[str, bool, int, int]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def list(self, path: str) -> List[Tuple[str, bool, int, int]]:
+        """Return sorted (name, is_dir, size, mtime_ns) entries of a directory."""
+        mtime_ns = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached is not None and cached[0] == mtime_ns:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        entries = []
+        with os.scandir(path) as iterator:
+            for entry in iterator:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                entries.append((entry.name, is_dir, 0 if is_dir else stat.st_size, stat.st_mtime_ns))
+        entries.sort()
+
+        with self._lock:
+            self._entries[path] = (mtime_ns, entries)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_directories:
+                self._entries.popitem(last=False)
+        return entries
+
+_directory_cache = _DirectoryCache(DIRECTORY_CACHE_SIZE)
+
+def _format_size(size: int) -> str:
+    for unit in ("B", "K", "M", "G"):
+        if size < 1024 or unit == "G":
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+
+def _new_tree_node() -> Dict[str, Any]:
+    return {"files": 0, "dirs": 0, "bytes": 0, "children": [], "complete": True}
+
+def _scan_tree(path: str, ignore: "trigram_index.IgnoreRules", budget: Dict[str, Any]) -> Dict[str, Any]:
+    """Build a directory node with its children and recursive file/dir/byte totals.
+
+    Directories are listed depth-first in name order from an explicit stack, so
+    deep trees do not hit the recursion limit. budget holds the entries "left"
+    to scan; when they run out the remaining directories are marked incomplete
+    instead of being listed, and "exhausted" is set. Unreadable directories are
+    marked incomplete as well.
+    """
+    root = _new_tree_node()
+    scanned = []
+    stack = [(root, path, "")]
+    while stack:
+        node, directory, relative_path = stack.pop()
+        scanned.append(node)
+        if budget["left"] <= 0:
+            budget["exhausted"] = True
+            node["complete"] = False
+            continue
+        try:
+            entries = _directory_cache.list(directory)
+        except OSError:
+            node["complete"] = False
+            continue
+        budget["left"] -= len(entries)
 
-@mcp.tool()
-async def diff_fenced_edit_file(diff_text: str) -> Dict[str, Any]:
+        subdirectories = []
+        for name, is_dir, size, mtime_ns in entries:
+            child_relative = f"{relative_path}/{name}" if relative_path else name
+            if ignore.ignored(child_relative, is_dir):
+                node["children"].append({"name": name, "is_dir": is_dir, "ignored": True})
+                continue
+            if is_dir:
+                child = _new_tree_node()
+                child.update(name=name, is_dir=True, mtime_ns=mtime_ns)
+                subdirectories.append((child, os.path.join(directory, name), child_relative))
+            else:
+                child = {"name": name, "is_dir": False, "size": size, "mtime_ns": mtime_ns}
+                node["files"] += 1
+                node["bytes"] += size
+            node["children"].append(child)
+        stack.extend(reversed(subdirectories))
+
+    # Every directory is scanned after its parent, so in reverse each one is totalled before its parent
+    for node in reversed(scanned):
+        for child in node["children"]:
+            if child["is_dir"] and not child.get("ignored"):
+                node["dirs"] += 1 + child["dirs"]
+                node["files"] += child["files"]
+                node["bytes"] += child["bytes"]
+                node["complete"] = node["complete"] and child["complete"]
+    return root
+
+def _list_tree(path: str, max_depth: int, max_lines: int, show_mtime: bool) -> str:
+    """Render a directory tree, collapsing subtrees that do not fit in max_lines."""
+    if not os.path.isdir(path):
+        if os.path.exists(path):
+            raise NotADirectoryError(f"Not a directory: {path}")
+        raise FileNotFoundError(f"No such directory: {path}")
+    budget = {"left": LIST_TREE_MAX_SCAN_ENTRIES, "exhausted": False}
+    root = _scan_tree(os.path.abspath(path), trigram_index.IgnoreRules.for_root(path), budget)
+
+    # Expand directories breadth-first while their children still fit; the rest show totals only
+    expanded = {id(root)}
+    used = len(root["children"])
+    queue = deque((child, 2) for child in root["children"] if child["is_dir"] and not child.get("ignored"))
+    while queue:
+        node, depth = queue.popleft()
+        if depth > max_depth or used + len(node["children"]) > max_lines:
+            continue
+        expanded.add(id(node))
+        used += len(node["children"])
+        queue.extend((child, depth + 1) for child in node["children"] if child["is_dir"] and not child.get("ignored"))
+
+    def describe(node: Dict[str, Any]) -> str:
+        if node.get("ignored"):
+            return f"{node['name']}{'/' if node['is_dir'] else ''} (ignored)"
+        mtime = ""
+        if show_mtime:
+            mtime = " " + datetime.datetime.fromtimestamp(node["mtime_ns"] / 1e9).strftime("%Y-%m-%d %H:%M")
+        if not node["is_dir"]:
+            return f"{node['name']} {_format_size(node['size'])}{mtime}"
+        incomplete = ", incomplete" if not node["complete"] else ""
+        return f"{node['name']}/ ({node['files']} files, {node['dirs']} dirs, {_format_size(node['bytes'])}{incomplete}){mtime}"
+
+    lines = [f"{os.path.abspath(path)}/ ({root['files']} files, {root['dirs']} dirs, {_format_size(root['bytes'])})"]
+
+    def render(node: Dict[str, Any], indent: str):
+        children = node["children"]
+        if node is root and len(children) > max_lines:
+            hidden = len(children) - max_lines
+            children = children[:max_lines]
+        else:
+            hidden = 0
+        for child in children:
+            lines.append(indent + describe(child))
+            if id(child) in expanded:
+                render(child, indent + "  ")
+        if hidden:
+            lines.append(f"{indent}... {hidden} more entries")
+
+    render(root, "  ")
+    if budget["exhausted"]:
+        lines.append(f"(stopped after scanning {LIST_TREE_MAX_SCAN_ENTRIES} entries; totals are partial)")
+    elif not root["complete"]:
+        lines.append("(some directories could not be read; totals are partial)")
+    return "\n".join(lines)
+
+@mcp.tool(annotations=ToolAnnotations(readOnlyHint=True))
+@metrics.instrument_tool
+async def list_tree(path: str, max_depth: int = 3, max_lines: int = LIST_TREE_MAX_LINES, show_mtime: bool = False) -> str:
+    """List a directory tree with file sizes and per-directory totals.
+
+Directories are expanded breadth-first up to `max_depth` levels while the
+output stays within `max_lines`; directories that do not fit are shown
+collapsed as one line with their file/dir counts and total size. .gitignore'd
+and common VCS/build directories are listed but not descended into. Sizes of
+files another program rewrote in place may lag until their directory changes.
+"""
+    return await _run_blocking(_list_tree, path, max_depth, max_lines, show_mtime)
+
+SEARCH_MAX_MATCHES_PER_FILE = 20
+SEARCH_MAX_LINE_CHARS = 300
+SEARCH_MAX_CONTEXT_LINES = 10
+# Candidate count above which a search is spread over the CPU process pool
+SEARCH_OFFLOAD_MIN_FILES = 256
+
+def _search_files(pattern_source: str, flags: int, root: str, relative_paths: List[str], context_lines: int) -> List[Tuple[str, int, List[Dict[str, Any]]]]:
+    """Match a regex against files and return (path, match count, line entries) for files that match.
+
+    Module-level and self-contained so it can run in the CPU process pool.
+    """
+    pattern = re.compile(pattern_source, flags)
+    hits = []
+    for relative_path in relative_paths:
+        try:
+            data, _ = _read_bytes(os.path.join(root, relative_path), populate=False)
+        except OSError:
+            continue
+        text = data.decode("utf-8", errors="replace")
+        matches = []
+        for match in pattern.finditer(text):
+            matches.append(match)
+            if len(matches) >= SEARCH_MAX_MATCHES_PER_FILE:
+                break
+        if not matches:
+            continue
+
+        lines = text.split("\n")
+        entries: List[Dict[str, Any]] = []
+        line_number, position = 0, 0
+        for match in matches:
+            line_number += text.count("\n", position, match.start())
+            position = match.start()
+            if entries and entries[-1]["line"] == line_number + 1:
+                # Several matches on one line are reported once
+                continue
+            entry: Dict[str, Any] = {"line": line_number + 1, "text": lines[line_number][:SEARCH_MAX_LINE_CHARS]}
+            if context_lines:
+                entry["before"] = [line[:SEARCH_MAX_LINE_CHARS] for line in lines[max(line_number - context_lines, 0):line_number]]
+                entry["after"] = [line[:SEARCH_MAX_LINE_CHARS] for line in lines[line_number + 1:line_number + 1 + context_lines]]
+            entries.append(entry)
+        hits.append((relative_path, len(matches), entries))
+    return hits
+
+def _search_files_counted(*args) -> Tuple[List[Tuple[str, int, List[Dict[str, Any]]]], Dict[str, int]]:
+    """_search_files for the CPU pool, also returning the bytes it read for the parent to record."""
+    with metrics.collect_bytes() as read:
+        hits = _search_files(*args)
+    return hits, read
+
+def _search(
+    query: str,
+    path: str,
+    regex: bool,
+    include: Optional[List[str]],
+    exclude: Optional[List[str]],
+    case_sensitive: bool,
+    max_results: int,
+    context_lines: int,
+) -> Dict[str, Any]:
+    """Search the files under path, narrowing candidates with the trigram index."""
+    index = trigram_index.index_for(path)
+    index.refresh()
+
+    flags = re.MULTILINE | (0 if case_sensitive else re.IGNORECASE)
+    pattern = re.compile(query if regex else re.escape(query), flags)
+    literals = trigram_index.regex_literals(query) if regex else [query]
+    if not case_sensitive:
+        literals = trigram_index.case_insensitive_literals(literals)
+    context_lines = max(0, min(context_lines, SEARCH_MAX_CONTEXT_LINES))
+    candidates = index.candidates(literals)
+
+    selected = [
+        relative_path for relative_path in candidates
+        if (not include or trigram_index.path_matches(relative_path, include))
+        and not (exclude and trigram_index.path_matches(relative_path, exclude))
+    ]
+
+    executor = _get_cpu_executor() if len(selected) >= SEARCH_OFFLOAD_MIN_FILES else None
+    if executor is None:
+        hits = _search_files(pattern.pattern, flags, index.root, selected, context_lines)
+    else:
+        # Scan candidate files in parallel worker processes, which read the files themselves
+        chunk = -(-len(selected) // CPU_WORKERS)
+        futures = [
+            executor.submit(_search_files_counted, pattern.pattern, flags, index.root, selected[i:i + chunk], context_lines)
+            for i in range(0, len(selected), chunk)
+        ]
+        hits = []
+        for future in futures:
+            chunk_hits, read = future.result()
+            hits.extend(chunk_hits)
+            for direction, amount in read.items():
+                metrics.record_bytes(direction, amount)
+
+    # Rank files whose name contains the query first, then by match count, then shallower paths
+    needle = query.lower()
+    hits.sort(key=lambda hit: (
+        needle not in hit[0].rsplit("/", 1)[-1].lower(),
+        -hit[1],
+        hit[0].count("/"),
+        hit[0],
+    ))
+
+    results = []
+    total = 0
+    for relative_path, _, entries in hits:
+        entries = entries[:max_results - total]
+        results.append({"path": os.path.join(index.root, relative_path), "matches": entries})
+        total += len(entries)
+        if total >= max_results:
+            break
+
+    return {
+        "results": results,
+        "files_matched": len(hits),
+        "candidates": len(candidates),
+        "indexed_files": len(index.files),
+        "truncated": total >= max_results,
+    }
+
+@mcp.tool(annotations=ToolAnnotations(readOnlyHint=True))
+@metrics.instrument_tool
+async def search(
+    query: str,
+    path: str,
+    regex: bool = False,
+    include: Optional[List[str]] = None,
+    exclude: Optional[List[str]] = None,
+    case_sensitive: bool = True,
+    max_results: int = 50,
+    context_lines: int = 2,
+) -> Dict[str, Any]:
+    """Search file contents under a directory and return ranked matches with line numbers.
+
+`query` is a literal string, or a Python regular expression with regex=True.
+`include`/`exclude` are glob lists (e.g. ["*.py"], ["tests/**"]); .gitignore
+and common build/VCS directories are skipped. Each match has its 1-based line
+number and up to `context_lines` lines of context.
+"""
+    return await _run_blocking(_search, query, path, regex, include, exclude, case_sensitive, max_results, context_lines)
+
+def _parse_edit_blocks(diff_text: str) -> List[Dict[str, Any]]:
+    """Parse diff-fenced text into edit blocks, numbered in request order."""
+    return [
+        {
+            "index": index,
+            "file": file_path,
+            "search": search_text.strip(),
+            "replace": replace_text.strip(),
+        }
+        for index, (file_path, search_text, replace_text)
+        in enumerate(EDIT_BLOCK_PATTERN.findall(diff_text))
+    ]
+
+def _group_blocks_by_file(blocks: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Group edit blocks by target file, keeping first-seen file order."""
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for block in blocks:
+        groups.setdefault(block["file"], []).append(block)
+    return groups
+
+def _find_occurrences(content: str, patterns: List[str]) -> Dict[str, List[int]]:
+    """Locate every occurrence of each pattern in a single scan of content.
+
+    The patterns are combined into one zero-width lookahead alternation, longest
+    first, so each position reports the longest pattern starting there; shorter
+    patterns that are prefixes of it are recorded at the same position.
+    """
+    occurrences: Dict[str, List[int]] = {pattern: [] for pattern in patterns}
+    if not patterns:
+        return occurrences
+
+    ordered = sorted(occurrences, key=len, reverse=True)
+    prefixes = {
+        pattern: [other for other in ordered if len(other) < len(pattern) and pattern.startswith(other)]
+        for pattern in ordered
+    }
+    scanner = re.compile("(?=(" + "|".join(re.escape(pattern) for pattern in ordered) + "))")
+
+    for match in scanner.finditer(content):
+        start = match.start()
+        longest = match.group(1)
+        occurrences[longest].append(start)
+        for prefix in prefixes[longest]:
+            occurrences[prefix].append(start)
+
+    return occurrences
+
+# Lines occurring more often than this (braces, "else:") are not used to rank near misses
+NEAR_MISS_MAX_ANCHOR_HITS = 64
+NEAR_MISS_CANDIDATES = 3
+NEAR_MISS_MAX_LINES = 20
+AMBIGUOUS_MAX_LINES_REPORTED = 10
+
+def _normalize_line(line: str) -> str:
+    return " ".join(line.split())
+
+def _leading_whitespace(line: str) -> str:
+    return line[:len(line) - len(line.lstrip())]
+
+class _NormalizedLines:
+    """A file's lines with whitespace normalized, indexed by content for line-anchored matching.
+
+    Matching a block looks up its rarest line in the index and only compares the
+    windows around those anchors, so it stays linear in the file size rather
+    than scanning every window.
+    """
+
+    def __init__(self, content: str):
+        self.lines = content.split("\n")
+        self.starts = list(accumulate((len(line) + 1 for line in self.lines[:-1]), initial=0))
+        self.normalized = [_normalize_line(line) for line in self.lines]
+        self.positions: Dict[str, List[int]] = {}
+        for number, line in enumerate(self.normalized):
+            if line:
+                self.positions.setdefault(line, []).append(number)
+
+    def find(self, wanted: List[str]) -> List[int]:
+        """Line numbers where the normalized lines `wanted` start."""
+        anchors = [(len(self.positions.get(line, ())), offset) for offset, line in enumerate(wanted) if line]
+        if not anchors:
+            return []
+        hits, offset = min(anchors)
+        if not hits:
+            return []
+        starts = (position - offset for position in self.positions[wanted[offset]])
+        return [start for start in starts if start >= 0 and self.normalized[start:start + len(wanted)] == wanted]
+
+    def span(self, start: int, count: int) -> Tuple[int, int]:
+        """Character span of lines [start, start + count) without the first line's indent or trailing whitespace,
+        mirroring the stripped SEARCH text."""
+        first, last = self.lines[start], self.lines[start + count - 1]
+        return (
+            self.starts[start] + len(_leading_whitespace(first)),
+            self.starts[start + count - 1] + len(last.rstrip()),
+        )
+
+    def near_misses(self, wanted: List[str]) -> List[Dict[str, Any]]:
+        """Regions sharing the most lines with `wanted` at the same relative positions."""
+        votes: Counter = Counter()
+        for offset, line in enumerate(wanted):
+            positions = self.positions.get(line, ())
+            if line and len(positions) <= NEAR_MISS_MAX_ANCHOR_HITS:
+                for position in positions:
+                    votes[max(position - offset, 0)] += 1
+        significant = sum(1 for line in wanted if line)
+        return [
+            {
+                "line": start + 1,
+                "similarity": round(hits / significant, 2),
+                "text": "\n".join(self.lines[start:start + min(len(wanted), NEAR_MISS_MAX_LINES)]),
+            }
+            for start, hits in votes.most_common(NEAR_MISS_CANDIDATES)
+        ]
+
+def _reindent(replace: str, search_lines: List[str], matched_lines: List[str]) -> str:
+    """Shift REPLACE lines after the first by the indent the file adds to (or drops from) SEARCH.
+
+    Left unchanged unless that shift is the same for every non-blank line.
+    """
+    pairs = [
+        (_leading_whitespace(searched), _leading_whitespace(matched))
+        for searched, matched in zip(search_lines[1:], matched_lines[1:])
+        if searched.strip()
+    ]
+    if not pairs:
+        return replace
+    added = {matched[:len(matched) - len(searched)] for searched, matched in pairs if matched.endswith(searched)}
+    dropped = {searched[:len(searched) - len(matched)] for searched, matched in pairs if searched.endswith(matched)}
+    lines = replace.split("\n")
+    if len(added) == 1 and all(matched.endswith(searched) for searched, matched in pairs):
+        prefix = added.pop()
+        return "\n".join(lines[:1] + [prefix + line if line.strip() else line for line in lines[1:]])
+    if len(dropped) == 1 and all(searched.endswith(matched) for searched, matched in pairs):
+        prefix = dropped.pop()
+        return "\n".join(lines[:1] + [line.removeprefix(prefix) for line in lines[1:]])
+    return replace
+
+def _line_number(content: str, position: int) -> int:
+    return content.count("\n", 0, position) + 1
+
+def _plan_file_edits(content: str, blocks: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]]]:
+    """Apply all edit blocks for one file against its original content.
+
+    Every SEARCH text must match exactly once in the original content and must
+    not overlap another block's match. A SEARCH text that is not found verbatim
+    may still match once when whitespace is ignored within each line; its
+    REPLACE text is then re-indented to the file. Otherwise the result lists
+    the closest regions of the file. Blocks with an empty SEARCH text append
+    their REPLACE text to the end of the file. Returns the new content and one
+    result per block.
+    """
+    results = {block["index"]: {"index": block["index"], "file": block["file"]} for block in blocks}
+    occurrences = _find_occurrences(content, [block["search"] for block in blocks if block["search"]])
+    # Built on the first block that needs whitespace-tolerant matching
+    normalized_lines: Optional[_NormalizedLines] = None
+
+    spans: List[Tuple[int, int, Dict[str, Any]]] = []
+    replacements: Dict[int, str] = {}
+    appends: List[Dict[str, Any]] = []
+    for block in blocks:
+        result = results[block["index"]]
+        if not block["search"]:
+            appends.append(block)
+            continue
+
+        starts = occurrences[block["search"]]
+        if len(starts) > 1:
+            result.update(
+                status="ambiguous",
+                message=f"SEARCH text found {len(starts)} times",
+                matches=len(starts),
+                lines=[_line_number(content, start) for start in starts[:AMBIGUOUS_MAX_LINES_REPORTED]],
+            )
+        elif starts:
+            spans.append((starts[0], starts[0] + len(block["search"]), block))
+        else:
+            if normalized_lines is None:
+                normalized_lines = _NormalizedLines(content)
+            search_lines = block["search"].split("\n")
+            wanted = [_normalize_line(line) for line in search_lines]
+            line_starts = normalized_lines.find(wanted)
+            if len(line_starts) == 1:
+                start, end = normalized_lines.span(line_starts[0], len(wanted))
+                matched_lines = normalized_lines.lines[line_starts[0]:line_starts[0] + len(wanted)]
+                replacements[block["index"]] = _reindent(block["replace"], search_lines, matched_lines)
+                result["match"] = "whitespace"
+                spans.append((start, end, block))
+            elif line_starts:
+                result.update(
+                    status="ambiguous",
+                    message=f"SEARCH text found {len(line_starts)} times when ignoring whitespace",
+                    matches=len(line_starts),
+                    lines=[start + 1 for start in line_starts[:AMBIGUOUS_MAX_LINES_REPORTED]],
+                )
+            else:
+                result.update(
+                    status="not_found",
+                    message="SEARCH text not found",
+                    candidates=normalized_lines.near_misses(wanted),
+                )
+
+    spans.sort(key=lambda span: span[0])
+    overlapping = set()
+    for (_, prev_end, prev_block), (start, _, block) in zip(spans, spans[1:]):
+        if start < prev_end:
+            overlapping.update((prev_block["index"], block["index"]))
+    for _, _, block in spans:
+        if block["index"] in overlapping:
+            results[block["index"]].update(status="overlap", message="SEARCH text overlaps another block")
+
+    pieces = []
+    cursor = 0
+    for start, end, block in spans:
+        result = results[block["index"]]
+        if block["index"] in overlapping:
+            continue
+        replace = replacements.get(block["index"], block["replace"])
+        pieces.append(content[cursor:start])
+        pieces.append(replace)
+        cursor = end
+        result.update(status="applied" if content[start:end] != replace else "unchanged")
+    pieces.append(content[cursor:])
+
+    for block in appends:
+        result = results[block["index"]]
+        if block["replace"]:
+            pieces.append('\n' + block["replace"])
+            result.update(status="applied")
+        else:
+            result.update(status="unchanged")
+
+    return "".join(pieces), [results[block["index"]] for block in blocks]
+
+def _stage_files(contents: Dict[str, bytes]) -> Dict[str, str]:
+    """Write each content to a temp file beside its target and fsync them as a group.
+
+    Returns a mapping of target path to staged temp path. On failure every temp
+    file is removed and the targets are left untouched.
+    """
+    staged: Dict[str, str] = {}
+    handles = []
+    try:
+        for file_path, content in contents.items():
+            target = pathlib.Path(file_path)
+            fd, temp_path = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.", suffix=".tmp")
+            staged[file_path] = temp_path
+            handle = os.fdopen(fd, "wb")
+            handles.append(handle)
+            handle.write(content)
+            if target.exists():
+                shutil.copymode(target, temp_path)
+        # Flush everything first so the kernel can batch the writeback, then fsync
+        for handle in handles:
+            handle.flush()
+        for handle in handles:
+            os.fsync(handle.fileno())
+    except BaseException:
+        for temp_path in staged.values():
+            pathlib.Path(temp_path).unlink(missing_ok=True)
+        raise
+    finally:
+        for handle in handles:
+            handle.close()
+    return staged
+
+def _fsync_directories(file_paths: List[str]) -> None:
+    """Persist renames by fsyncing each parent directory once."""
+    for directory in {str(pathlib.Path(file_path).parent) for file_path in file_paths}:
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+def _commit_files(contents: Dict[str, bytes], originals: Dict[str, bytes]) -> None:
+    """Atomically replace a group of files: stage, fsync, then rename into place.
+
+    Every file must already exist, with its bytes in originals. If a rename
+    fails part way, files already replaced are restored from originals and the
+    error is re-raised. On success the content cache is updated with the new bytes.
+    """
+    staged = _stage_files(contents)
+    replaced: List[str] = []
+    try:
+        for file_path, temp_path in staged.items():
+            os.replace(temp_path, file_path)
+            replaced.append(file_path)
+    except OSError:
+        for temp_path in staged.values():
+            pathlib.Path(temp_path).unlink(missing_ok=True)
+        restore = {file_path: originals[file_path] for file_path in replaced}
+        if restore:
+            for file_path, temp_path in _stage_files(restore).items():
+                os.replace(temp_path, file_path)
+        raise
+    _fsync_directories(replaced)
+    for file_path in replaced:
+        metrics.record_bytes("written", len(contents[file_path]))
+        _content_cache.put(file_path, os.stat(file_path), contents[file_path])
+        trigram_index.notify_written(file_path, contents[file_path])
+
+EDIT_BLOCKS = metrics.REGISTRY.counter("toolkami_edit_blocks_total", "Edit blocks by status (applied, not_found, ambiguous, ...).", ("status",))
+
+def _diff_fenced_edit(edit_blocks: List[Dict[str, Any]], atomic: bool) -> Dict[str, Any]:
+    """Apply and commit parsed edit blocks; see diff_fenced_edit_file."""
+
+    block_results: List[Dict[str, Any]] = []
+    originals: Dict[str, bytes] = {}
+    contents: Dict[str, bytes] = {}
+    results_by_file: Dict[str, List[Dict[str, Any]]] = {}
+    for file_path, blocks in _group_blocks_by_file(edit_blocks).items():
+        try:
+            data, _ = _read_bytes(file_path)
+            content = _decode_text(data)
+        except (OSError, UnicodeDecodeError) as e:
+            block_results.extend(
+                {"index": block["index"], "file": file_path, "status": "error", "message": str(e)}
+                for block in blocks
+            )
+            continue
+
+        new_content, results = _run_cpu(_plan_file_edits, content, blocks, size=len(content))
+        if new_content != content:
+            originals[file_path] = data
+            contents[file_path] = new_content.encode("utf-8")
+        results_by_file[file_path] = results
+        block_results.extend(results)
+
+    def fail_applied(file_paths, status, message=None):
+        for file_path in file_paths:
+            for result in results_by_file.get(file_path, []):
+                if result["status"] == "applied":
+                    result["status"] = status
+                    if message:
+                        result["message"] = message
+
+    committed = True
+    if atomic:
+        # A block whose REPLACE equals its SEARCH needs no change, which does not fail the transaction
+        if any(result["status"] not in ("applied", "unchanged") for result in block_results):
+            committed = False
+            fail_applied(contents, "rolled_back", "Transaction aborted because another block failed")
+        elif contents:
+            try:
+                _commit_files(contents, originals)
+            except OSError as e:
+                committed = False
+                fail_applied(contents, "error", str(e))
+    else:
+        # Each file is still replaced atomically, but independently of the others
+        for file_path, new_content in contents.items():
+            try:
+                _commit_files({file_path: new_content}, originals)
+            except OSError as e:
+                fail_applied([file_path], "error", str(e))
+
+    block_results.sort(key=lambda result: result["index"])
+    blocks_edited = sum(1 for result in block_results if result["status"] == "applied")
+    for result in block_results:
+        EDIT_BLOCKS.inc((result["status"],))
+
+    response = {
+        "success": blocks_edited == len(edit_blocks),
+        "blocks_edited": blocks_edited,
+        "blocks": block_results,
+    }
+    if atomic:
+        response["committed"] = committed
+    return response
+
+def _diff_fenced_edit_locked(diff_text: str, atomic: bool) -> Dict[str, Any]:
+    edit_blocks = _run_cpu(_parse_edit_blocks, diff_text, size=len(diff_text))
+    with _edit_locks([block["file"] for block in edit_blocks]):
+        return _diff_fenced_edit(edit_blocks, atomic)
+
+@mcp.tool(annotations=ToolAnnotations(readOnlyHint=False, destructiveHint=True))
+@metrics.instrument_tool
+async def diff_fenced_edit_file(diff_text: str, atomic: bool = False) -> Dict[str, Any]:
     """Edit files using a diff-fenced format and return the status.
 
 Basic Format Structure:
@@ -28,35 +1201,14 @@ Basic Format Structure:
 // new text that will replace the original content  
 >>>>>>> REPLACE  
 ```
+
+Blocks for the same file are matched against the file as it was before this
+call; each SEARCH text must match exactly once. If it only matches when
+whitespace within lines is ignored, it is applied there with REPLACE
+re-indented (the block's result has "match": "whitespace"). A block that does
+not match lists the closest "candidates" regions with their line numbers. The
+response lists the status of every block in order. Files are replaced atomically (temp file, fsync,
+rename). With atomic=True the whole call is a transaction: if any block fails
+no file is modified.
 """
-    pattern = r'```diff\n(.*?)\n<<<<<<< SEARCH\n(.*?)=======\n(.*?)>>>>>>> REPLACE\n```'
-    edit_blocks = re.findall(pattern, diff_text, re.DOTALL)
-    
-    blocks_edited = 0
-    for block in edit_blocks:
-        if len(block) == 3:
-            file_path, search_text, replace_text = block
-
-            search_text = search_text.strip()
-            replace_text = replace_text.strip()
-
-            content = pathlib.Path(file_path).read_text()
-            original_content = content
-            
-            # Replace the search text with the replace text
-            if search_text in content:
-                content = content.replace(search_text, replace_text)
-            else:
-                # If search text not found and it's empty, append the replace text
-                if not search_text.strip():
-                    content += '\n' + replace_text
-
-            # Only increment blocks_edited if content actually changed
-            if content != original_content:
-                pathlib.Path(file_path).write_text(content)
-                blocks_edited += 1
-
-    if blocks_edited == len(edit_blocks):
-        return {"success": True, "blocks_edited": blocks_edited}
-    
-    return {"success": False, "blocks_edited": blocks_edited}
\ No newline at end of file
+    return await _run_blocking(_diff_fenced_edit_locked, diff_text, atomic)
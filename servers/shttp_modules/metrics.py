@@ -0,0 +1,421 @@
+"""Per-tool metrics and optional trace spans for the MCP servers.
+
+Tools are wrapped with `instrument_tool`, which records call counts by outcome,
+a latency histogram and response sizes. `MetricsMiddleware` records the same
+for every HTTP request, and `metrics_endpoint` serves everything in Prometheus
+text format. Recording is a dict lookup and a few additions under a lock, cheap
+enough to leave on in production.
+
+With several uvicorn workers each process has its own metrics. When
+TOOLKAMI_METRICS_DIR is set, every process periodically writes a snapshot there
+and /metrics sums the snapshots of all live processes, so a scrape served by
+any worker covers the whole server.
+
+Set TOOLKAMI_TRACE_FILE to also append one JSON line per HTTP request and tool
+call (trace id, span id, parent, name, start, duration, outcome).
+"""
+
+import os
+import json
+import time
+import uuid
+import bisect
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from starlette.responses import PlainTextResponse
+
+METRICS_DIR = os.getenv("TOOLKAMI_METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.getenv("TOOLKAMI_METRICS_FLUSH_SECONDS", "5"))
+TRACE_FILE = os.getenv("TOOLKAMI_TRACE_FILE")
+
+# Latency buckets in seconds, from a cached read to a large multi-file edit
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Response size buckets in bytes
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+class Counter:
+    """Monotonic counter keyed by a tuple of label values."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def snapshot(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self.lock:
+            return list(self.values.items())
+
+class Histogram:
+    """Bucketed distribution keyed by label values; stores per-bucket counts, sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [count per bucket..., count above the last bucket, sum]
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+            counts[position] += 1
+            counts[-1] += value
+
+    def snapshot(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self.lock:
+            return [(labels, list(counts)) for labels, counts in self.values.items()]
+
+class Registry:
+    """Metrics of one process, plus gauge collectors evaluated at scrape time."""
+
+    def __init__(self):
+        self.metrics: Dict[str, Any] = {}
+        self.collectors: List[Callable[[], Dict[str, Tuple[str, float]]]] = []
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, help, labelnames, buckets))
+
+    def register_collector(self, collector: Callable[[], Dict[str, Tuple[str, float]]]) -> None:
+        """Add a callable returning {metric name: (help, value)} gauges, read on every scrape."""
+        self.collectors.append(collector)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """JSON-serializable state of every metric, in the form merged across processes."""
+        state = {
+            metric.name: {
+                "kind": metric.kind,
+                "help": metric.help,
+                "labelnames": list(metric.labelnames),
+                "buckets": list(getattr(metric, "buckets", ())),
+                "values": [[list(labels), value] for labels, value in metric.snapshot()],
+            }
+            for metric in self.metrics.values()
+        }
+        for collector in self.collectors:
+            try:
+                gauges = collector()
+            except Exception:
+                continue
+            for name, (help, value) in gauges.items():
+                state[name] = {"kind": "gauge", "help": help, "labelnames": [], "buckets": [], "values": [[[], value]]}
+        return state
+
+REGISTRY = Registry()
+
+TOOL_CALLS = REGISTRY.counter("toolkami_tool_calls_total", "Tool calls by outcome (ok, failure, error).", ("tool", "outcome"))
+TOOL_LATENCY = REGISTRY.histogram("toolkami_tool_duration_seconds", "Tool call latency.", ("tool",))
+TOOL_RESPONSE_BYTES = REGISTRY.histogram("toolkami_tool_response_bytes", "Characters of text in tool results.", ("tool",), SIZE_BUCKETS)
+FILE_BYTES = REGISTRY.counter("toolkami_file_bytes_total", "Bytes read from or written to disk by tools.", ("tool", "direction"))
+HTTP_REQUESTS = REGISTRY.counter("toolkami_http_requests_total", "HTTP requests by mount, method and status.", ("mount", "method", "status"))
+HTTP_LATENCY = REGISTRY.histogram("toolkami_http_request_duration_seconds", "HTTP request latency.", ("mount",))
+
+# Tool and trace span of the current request, for attributing bytes and nesting spans
+_current_tool: contextvars.ContextVar[str] = contextvars.ContextVar("toolkami_current_tool", default="")
+_current_span: contextvars.ContextVar[Optional[Tuple[str, str]]] = contextvars.ContextVar("toolkami_current_span", default=None)
+# Set by collect_bytes: bytes by direction, kept for the caller instead of this process's metrics
+_collected_bytes: contextvars.ContextVar[Optional[Dict[str, int]]] = contextvars.ContextVar("toolkami_collected_bytes", default=None)
+
+def current_tool() -> str:
+    """Name of the tool being run, or "" outside a tool call.
+
+    The context is copied into the I/O pool by the filesystem tools, so this
+    also works in their worker threads.
+    """
+    return _current_tool.get()
+
+def record_bytes(direction: str, amount: int, tool: Optional[str] = None) -> None:
+    """Count bytes a tool read ("read") or wrote ("written")."""
+    collected = _collected_bytes.get()
+    if collected is not None:
+        collected[direction] = collected.get(direction, 0) + amount
+        return
+    FILE_BYTES.inc((tool or current_tool() or "none", direction), amount)
+
+@contextmanager
+def collect_bytes() -> Iterator[Dict[str, int]]:
+    """Gather the bytes recorded inside the block into the yielded dict instead of the metrics.
+
+    For work in child processes, whose metrics nobody scrapes: return the dict
+    to the parent and replay it there with record_bytes.
+    """
+    collected: Dict[str, int] = {}
+    token = _collected_bytes.set(collected)
+    try:
+        yield collected
+    finally:
+        _collected_bytes.reset(token)
+
+def _format_labels(labelnames, labels, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def render(state: Dict[str, Dict[str, Any]]) -> str:
+    """Prometheus text exposition of a (possibly merged) registry snapshot."""
+    lines = []
+    for name in sorted(state):
+        metric = state[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        labelnames = metric["labelnames"]
+        for labels, value in sorted(metric["values"]):
+            if metric["kind"] != "histogram":
+                lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(metric["buckets"] + ["+Inf"], value):
+                cumulative += count
+                bucket_labels = _format_labels(labelnames, labels, 'le="%s"' % bound)
+                lines.append(f"{name}_bucket{bucket_labels} {_format_number(cumulative)}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, labels)} {_format_number(value[-1])}")
+            lines.append(f"{name}_count{_format_labels(labelnames, labels)} {_format_number(cumulative)}")
+    return "\n".join(lines) + "\n"
+
+def merge(states: List[Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """Sum snapshots from several processes, label set by label set."""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for state in states:
+        for name, metric in state.items():
+            target = merged.setdefault(name, {**metric, "values": {}})
+            for labels, value in metric["values"]:
+                key = tuple(labels)
+                if key not in target["values"]:
+                    target["values"][key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    target["values"][key] = [a + b for a, b in zip(target["values"][key], value)]
+                else:
+                    target["values"][key] += value
+    for metric in merged.values():
+        metric["values"] = [[list(labels), value] for labels, value in metric["values"].items()]
+    return merged
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"metrics-{pid}.json")
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def write_snapshot() -> None:
+    """Publish this process's metrics to METRICS_DIR for the other workers to merge."""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = _snapshot_path(os.getpid())
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(REGISTRY.snapshot(), f, separators=(",", ":"))
+    os.replace(temp_path, path)
+
+def collect() -> Dict[str, Dict[str, Any]]:
+    """This process's live metrics, merged with the latest snapshots of other live workers."""
+    states = [REGISTRY.snapshot()]
+    if not METRICS_DIR:
+        return states[0]
+    try:
+        names = os.listdir(METRICS_DIR)
+    except OSError:
+        names = []
+    for name in names:
+        if not (name.startswith("metrics-") and name.endswith(".json")):
+            continue
+        pid = int(name[len("metrics-"):-len(".json")])
+        if pid == os.getpid():
+            continue
+        path = os.path.join(METRICS_DIR, name)
+        if not _pid_alive(pid):
+            # Workers that exited keep no history; a restarted server starts from zero
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(path) as f:
+                states.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return merge(states)
+
+_flusher_started = False
+_flusher_lock = threading.Lock()
+
+def _start_flusher() -> None:
+    """Start the snapshot thread once per process, on first use rather than at import."""
+    global _flusher_started
+    if not METRICS_DIR or _flusher_started:
+        return
+    with _flusher_lock:
+        if _flusher_started:
+            return
+        _flusher_started = True
+
+    def flush_forever():
+        while True:
+            try:
+                write_snapshot()
+            except OSError:
+                pass
+            time.sleep(METRICS_FLUSH_SECONDS)
+
+    threading.Thread(target=flush_forever, name="metrics-flush", daemon=True).start()
+
+_trace_lock = threading.Lock()
+_trace_file = None
+
+def _write_span(span: Dict[str, Any]) -> None:
+    global _trace_file
+    line = json.dumps(span, separators=(",", ":")) + "\n"
+    with _trace_lock:
+        if _trace_file is None:
+            _trace_file = open(TRACE_FILE, "a", buffering=1)
+        _trace_file.write(line)
+
+def _start_span(name: str, trace_id: Optional[str] = None) -> Tuple[Dict[str, Any], contextvars.Token]:
+    parent = _current_span.get()
+    span = {
+        "trace_id": trace_id or (parent[0] if parent else uuid.uuid4().hex),
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent[1] if parent else None,
+        "name": name,
+        "pid": os.getpid(),
+        "start": time.time(),
+    }
+    return span, _current_span.set((span["trace_id"], span["span_id"]))
+
+def _end_span(span: Dict[str, Any], token: contextvars.Token, duration: float, **attributes) -> None:
+    _current_span.reset(token)
+    span.update(duration_ms=round(duration * 1e3, 3), **attributes)
+    _write_span(span)
+
+def _outcome(result: Any) -> str:
+    """A result dict with success=False (e.g. fewer blocks_edited than blocks) counts as a failure."""
+    if isinstance(result, dict) and result.get("success") is False:
+        return "failure"
+    return "ok"
+
+def _result_size(result: Any) -> int:
+    """Characters of text in a result, counted without serializing it (keys and numbers are left out)."""
+    if isinstance(result, (str, bytes)):
+        return len(result)
+    if isinstance(result, dict):
+        return sum(_result_size(value) for value in result.values())
+    if isinstance(result, (list, tuple)):
+        return sum(_result_size(value) for value in result)
+    return 0
+
+T = TypeVar("T")
+
+def instrument_tool(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """Record calls, latency, outcome and result size of an async tool.
+
+    Apply below @mcp.tool so FastMCP still sees the original signature and docstring.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        _start_flusher()
+        tool_token = _current_tool.set(name)
+        span = None
+        if TRACE_FILE:
+            span, span_token = _start_span(f"tool {name}")
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await func(*args, **kwargs)
+            outcome = _outcome(result)
+            TOOL_RESPONSE_BYTES.observe((name,), _result_size(result))
+            return result
+        finally:
+            duration = time.perf_counter() - start
+            _current_tool.reset(tool_token)
+            TOOL_CALLS.inc((name, outcome))
+            TOOL_LATENCY.observe((name,), duration)
+            if span is not None:
+                _end_span(span, span_token, duration, outcome=outcome)
+
+    return wrapper
+
+def _mount(path: str) -> str:
+    """First path segment, which keeps the label set bounded to the mounted servers."""
+    return "/" + path.lstrip("/").split("/", 1)[0]
+
+def _trace_id_from_headers(headers) -> Optional[str]:
+    """Trace id from a W3C traceparent header (version-traceid-parentid-flags), if present."""
+    for key, value in headers:
+        if key == b"traceparent":
+            parts = value.decode("latin-1").split("-")
+            if len(parts) == 4 and len(parts[1]) == 32:
+                return parts[1]
+    return None
+
+class MetricsMiddleware:
+    """Pure ASGI middleware timing every HTTP request; streaming responses are not buffered."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        _start_flusher()
+        mount = _mount(scope["path"])
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        span = None
+        if TRACE_FILE:
+            span, span_token = _start_span(f"{scope['method']} {scope['path']}", _trace_id_from_headers(scope.get("headers", [])))
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start
+            HTTP_REQUESTS.inc((mount, scope["method"], str(status)))
+            HTTP_LATENCY.observe((mount,), duration)
+            if span is not None:
+                _end_span(span, span_token, duration, status=status)
+
+async def metrics_endpoint(request):
+    """Starlette endpoint serving the merged metrics in Prometheus text format."""
+    return PlainTextResponse(render(collect()), media_type="text/plain; version=0.0.4; charset=utf-8")
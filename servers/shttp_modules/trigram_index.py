@@ -0,0 +1,379 @@
+"""Persistent trigram index of a directory tree, used by the filesystem search tool.
+
+Each indexed file's lowercased bytes are reduced to the set of 3-byte sequences
+it contains. A query is narrowed to the files containing every trigram of its
+required literals before any file is read, so a search touches only a handful
+of candidates instead of the whole tree. Text files too large to index are
+tracked by name and always returned as candidates, so they are scanned directly.
+"""
+
+import os
+import re
+import time
+import pickle
+import fnmatch
+import hashlib
+import pathlib
+import tempfile
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    import re._parser as sre_parse
+    from re._constants import LITERAL, SUBPATTERN
+except ImportError:  # Python < 3.11
+    import sre_parse
+    from sre_constants import LITERAL, SUBPATTERN
+
+# Directory and file patterns that are never indexed, in .gitignore syntax
+DEFAULT_IGNORES = [
+    ".git/", ".hg/", ".svn/", "node_modules/", "__pycache__/", ".venv/", "venv/",
+    ".mypy_cache/", ".pytest_cache/", ".ruff_cache/", ".tox/", ".nox/", "*.pyc",
+]
+MAX_INDEXED_FILE_BYTES = int(os.getenv("FILESYSTEM_INDEX_MAX_FILE_BYTES", str(1024 * 1024)))
+BINARY_SNIFF_BYTES = 8192
+# Minimum seconds between mtime scans of the tree; edits made through the server update the index directly
+RESCAN_INTERVAL = float(os.getenv("FILESYSTEM_INDEX_RESCAN_SECONDS", "30"))
+# Minimum seconds between saves of a changed index; changes not saved yet are found again by mtime after a restart
+SAVE_INTERVAL = float(os.getenv("FILESYSTEM_INDEX_SAVE_SECONDS", "300"))
+INDEX_DIR = pathlib.Path(os.getenv("FILESYSTEM_INDEX_DIR", pathlib.Path.home() / ".cache" / "toolkami" / "search")).expanduser()
+INDEX_VERSION = 3
+# Non-ASCII characters re.IGNORECASE matches to an ASCII letter, folded to that letter before lowercasing
+# (U+0130, U+0131, U+212A Kelvin sign, U+017F long s), as UTF-8
+ASCII_CASE_FOLDS = [(b"\xc4\xb0", b"i"), (b"\xc4\xb1", b"i"), (b"\xe2\x84\xaa", b"k"), (b"\xc5\xbf", b"s")]
+ASCII_RUN = re.compile(r"[\x00-\x7f]{3,}")
+
+def trigrams(data: bytes) -> Set[int]:
+    """Distinct lowercased trigrams of data, packed into 24-bit integers."""
+    for char, letter in ASCII_CASE_FOLDS:
+        if char in data:
+            data = data.replace(char, letter)
+    data = data.lower()
+    return {(a << 16) | (b << 8) | c for a, b, c in set(zip(data, data[1:], data[2:]))}
+
+def regex_literals(pattern: str) -> List[str]:
+    """Literal substrings every match of the regex must contain.
+
+    Only top-level concatenations are considered (groups without alternation
+    are descended into); anything else just ends the current literal run, so
+    the result is always a safe under-approximation.
+    """
+    literals: List[str] = []
+
+    def walk(items, run: List[str]) -> List[str]:
+        for op, arg in items:
+            if op == LITERAL:
+                run.append(chr(arg))
+            elif op == SUBPATTERN:
+                run = walk(arg[-1], run)
+            else:
+                if run:
+                    literals.append("".join(run))
+                run = []
+        return run
+
+    try:
+        parsed = sre_parse.parse(pattern)
+    except Exception:
+        return []
+    tail = walk(parsed, [])
+    if tail:
+        literals.append("".join(tail))
+    return [literal for literal in literals if len(literal.encode("utf-8")) >= 3]
+
+def case_insensitive_literals(literals: List[str]) -> List[str]:
+    """The ASCII runs of literals, for a case-insensitive query.
+
+    bytes.lower() folds only ASCII, while re.IGNORECASE also matches "É" in a
+    query to "é" in a file, so non-ASCII characters cannot be used to filter.
+    """
+    return [run for literal in literals for run in ASCII_RUN.findall(literal)]
+
+class IgnoreRules:
+    """A subset of .gitignore matching: globs, trailing '/' for directories, leading '/' to anchor."""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.rules: List[Tuple[str, bool, bool]] = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith(("#", "!")):
+                continue
+            directory_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            anchored = pattern.startswith("/") or "/" in pattern
+            self.rules.append((pattern.lstrip("/"), directory_only, anchored))
+
+    @classmethod
+    def for_root(cls, root: str) -> "IgnoreRules":
+        patterns = list(DEFAULT_IGNORES)
+        try:
+            patterns += pathlib.Path(root, ".gitignore").read_text().splitlines()
+        except (OSError, UnicodeDecodeError):
+            pass
+        return cls(patterns)
+
+    def ignored(self, relative_path: str, is_dir: bool) -> bool:
+        name = relative_path.rsplit("/", 1)[-1]
+        for pattern, directory_only, anchored in self.rules:
+            if directory_only and not is_dir:
+                continue
+            if fnmatch.fnmatchcase(relative_path if anchored else name, pattern):
+                return True
+        return False
+
+def path_matches(relative_path: str, patterns: Optional[List[str]]) -> bool:
+    """Whether a path matches any glob; globs without '/' match the file name."""
+    name = relative_path.rsplit("/", 1)[-1]
+    return any(
+        fnmatch.fnmatchcase(relative_path if "/" in pattern else name, pattern)
+        or (pattern.startswith("**/") and fnmatch.fnmatchcase(relative_path, pattern[3:]))
+        for pattern in patterns or []
+    )
+
+class TrigramIndex:
+    """Trigram postings for the text files under one root directory.
+
+    Files are tracked by (mtime_ns, size) so a rescan only re-reads files that
+    changed. The index is pickled under INDEX_DIR and reloaded on first use.
+    Text files over MAX_INDEXED_FILE_BYTES have no trigrams and are a candidate
+    for every query; binary files are left out.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.lock = threading.RLock()
+        self.files: Dict[str, Tuple[int, int, int]] = {}  # relative path -> (file id, mtime_ns, size)
+        self.paths: Dict[int, str] = {}  # file id -> relative path
+        self.file_trigrams: Dict[int, bytes] = {}  # file id -> packed array('I') of its trigrams
+        self.postings: Dict[int, Set[int]] = {}  # trigram -> file ids
+        self.large_files: Dict[str, Tuple[int, int]] = {}  # relative path -> (mtime_ns, size) of unindexed text files
+        self.next_id = 0
+        self.last_scan = 0.0
+        self.last_save = float("-inf")
+        self.dirty = False
+        # Held for a whole rescan, so only one thread walks the tree at a time
+        self._scan_lock = threading.Lock()
+        self.ignore = IgnoreRules.for_root(self.root)
+        self.store_path = INDEX_DIR / (hashlib.sha1(self.root.encode("utf-8")).hexdigest() + ".pickle")
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.store_path, "rb") as f:
+                state = pickle.load(f)
+        except Exception:
+            # Missing, unreadable or from an incompatible version: rebuild from scratch
+            return
+        if state.get("version") != INDEX_VERSION or state.get("root") != self.root:
+            return
+        self.files, self.file_trigrams, self.next_id = state["files"], state["file_trigrams"], state["next_id"]
+        self.large_files = state["large_files"]
+        self.paths = {file_id: path for path, (file_id, _, _) in self.files.items()}
+        for file_id, packed in self.file_trigrams.items():
+            for trigram in array("I", packed):
+                self.postings.setdefault(trigram, set()).add(file_id)
+
+    def save(self, force: bool = False):
+        """Persist the index if it changed, at most once per SAVE_INTERVAL unless forced.
+
+        The state is copied under the lock and pickled outside it. Each save writes
+        its own temp file, so server workers saving the same index at once do not
+        interleave their writes.
+        """
+        with self.lock:
+            if not self.dirty or (not force and time.monotonic() - self.last_save < SAVE_INTERVAL):
+                return
+            state = {
+                "version": INDEX_VERSION,
+                "root": self.root,
+                "files": dict(self.files),
+                "file_trigrams": dict(self.file_trigrams),
+                "next_id": self.next_id,
+                "large_files": dict(self.large_files),
+            }
+            self.dirty = False
+            self.last_save = time.monotonic()
+        try:
+            self.store_path.parent.mkdir(parents=True, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.store_path.parent, prefix=".tmp-", suffix=".pickle")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_path, self.store_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+                raise
+        except BaseException:
+            with self.lock:
+                self.dirty = True
+            raise
+
+    def _remove(self, relative_path: str):
+        if self.large_files.pop(relative_path, None) is not None:
+            self.dirty = True
+        entry = self.files.pop(relative_path, None)
+        if entry is None:
+            return
+        file_id = entry[0]
+        del self.paths[file_id]
+        for trigram in array("I", self.file_trigrams.pop(file_id, b"")):
+            ids = self.postings.get(trigram)
+            if ids is not None:
+                ids.discard(file_id)
+                if not ids:
+                    del self.postings[trigram]
+        self.dirty = True
+
+    def _known_stat(self, relative_path: str) -> Optional[Tuple[int, int]]:
+        """(mtime_ns, size) the index holds for a file, or None if it does not track it."""
+        entry = self.files.get(relative_path)
+        return entry[1:] if entry is not None else self.large_files.get(relative_path)
+
+    def _apply(self, relative_path: str, stat: os.stat_result, grams: Optional[Set[int]]):
+        """Record a file's new content, given its trigrams or None for a large text file; needs the lock."""
+        self._remove(relative_path)
+        if grams is None:
+            self.large_files[relative_path] = (stat.st_mtime_ns, stat.st_size)
+        else:
+            file_id = self.next_id
+            self.next_id += 1
+            self.files[relative_path] = (file_id, stat.st_mtime_ns, stat.st_size)
+            self.paths[file_id] = relative_path
+            self.file_trigrams[file_id] = array("I", grams).tobytes()
+            for trigram in grams:
+                self.postings.setdefault(trigram, set()).add(file_id)
+        self.dirty = True
+
+    def update_file(self, relative_path: str, data: bytes, stat: os.stat_result):
+        """(Re)index one file from its content; binary files are dropped and oversized ones only tracked."""
+        binary = b"\0" in data[:BINARY_SNIFF_BYTES]
+        grams = None if binary or len(data) > MAX_INDEXED_FILE_BYTES else trigrams(data)
+        with self.lock:
+            if binary:
+                self._remove(relative_path)
+            else:
+                self._apply(relative_path, stat, grams)
+
+    def notify_written(self, path: str, data: bytes):
+        """Update the index for a file written through the server, skipping the next scan of it."""
+        relative_path = os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, "/")
+        if relative_path.startswith("../") or self.ignore.ignored(relative_path, False):
+            return
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        self.update_file(relative_path, data, stat)
+
+    def _walk(self):
+        """Yield (relative path, stat) for every indexable file under the root."""
+        stack = [""]
+        while stack:
+            relative_dir = stack.pop()
+            try:
+                entries = list(os.scandir(os.path.join(self.root, relative_dir)))
+            except OSError:
+                continue
+            for entry in entries:
+                relative_path = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not self.ignore.ignored(relative_path, True):
+                            stack.append(relative_path)
+                    elif entry.is_file(follow_symlinks=False):
+                        if not self.ignore.ignored(relative_path, False):
+                            yield relative_path, entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+
+    def refresh(self, force: bool = False) -> bool:
+        """Rescan the tree by mtime/size and reindex what changed; rate limited by RESCAN_INTERVAL.
+
+        The walk, reads and trigram extraction run without self.lock, so searches
+        keep using the current index meanwhile; the changes are applied at the end.
+        A rescan that finds another one running is skipped, except for the first,
+        which builds the index and is waited for.
+        """
+        if not force and time.monotonic() - self.last_scan < RESCAN_INTERVAL:
+            return False
+        if not self._scan_lock.acquire(blocking=not self.last_scan):
+            return False
+        try:
+            if not force and time.monotonic() - self.last_scan < RESCAN_INTERVAL:
+                # Another thread rescanned while this one waited
+                return False
+            with self.lock:
+                known = set(self.files) | set(self.large_files)
+            seen = set()
+            # (relative path, stat the index held, new stat, trigrams or None for a large text file)
+            changed: List[Tuple[str, Optional[Tuple[int, int]], os.stat_result, Optional[Set[int]]]] = []
+            binary = []
+            for relative_path, stat in self._walk():
+                seen.add(relative_path)
+                held = self._known_stat(relative_path)
+                if held == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                large = stat.st_size > MAX_INDEXED_FILE_BYTES
+                try:
+                    with open(os.path.join(self.root, relative_path), "rb") as f:
+                        # Large files are only sniffed for binary content; large text files are scanned at search time
+                        data = f.read(BINARY_SNIFF_BYTES) if large else f.read()
+                except OSError:
+                    continue
+                if b"\0" in data[:BINARY_SNIFF_BYTES]:
+                    binary.append(relative_path)
+                    continue
+                changed.append((relative_path, held, stat, None if large else trigrams(data)))
+
+            with self.lock:
+                for relative_path, held, stat, grams in changed:
+                    # Skip files written through the server during the walk, which are already newer
+                    if self._known_stat(relative_path) == held:
+                        self._apply(relative_path, stat, grams)
+                for relative_path in [*binary, *(known - seen)]:
+                    self._remove(relative_path)
+                self.last_scan = time.monotonic()
+        finally:
+            self._scan_lock.release()
+        self.save()
+        return True
+
+    def candidates(self, literals: List[str]) -> List[str]:
+        """Relative paths of files that contain every trigram of every literal, plus all large files.
+
+        With no literal of three or more bytes every indexed file is a candidate.
+        """
+        with self.lock:
+            grams: Set[int] = set()
+            for literal in literals:
+                grams |= trigrams(literal.encode("utf-8"))
+            if not grams:
+                return sorted([*self.files, *self.large_files])
+            postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+            ids = set(postings[0])
+            for ids_with_gram in postings[1:]:
+                ids &= ids_with_gram
+                if not ids:
+                    break
+            return sorted([*(self.paths[file_id] for file_id in ids), *self.large_files])
+
+_indexes: Dict[str, TrigramIndex] = {}
+_indexes_lock = threading.Lock()
+
+def index_for(root: str) -> TrigramIndex:
+    """Return the shared index for a root directory, loading or creating it."""
+    root = os.path.abspath(root)
+    with _indexes_lock:
+        if root not in _indexes:
+            _indexes[root] = TrigramIndex(root)
+        return _indexes[root]
+
+def notify_written(path: str, data: bytes):
+    """Tell every loaded index containing path about its new content."""
+    path = os.path.abspath(path)
+    with _indexes_lock:
+        indexes = [index for root, index in _indexes.items() if path.startswith(root + os.sep)]
+    for index in indexes:
+        index.notify_written(path, data)